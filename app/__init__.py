@@ -1,10 +1,11 @@
 from datetime import datetime, timedelta
 
-from flask import Flask, current_app
+from flask import Flask, current_app, jsonify, request
 from flask_login import current_user
 
 from config import Config
 from .extensions import login_manager, mysql, socketio, init_extensions
+from .pool import PoolOcupadoError
 from .blueprints.auth import auth_bp
 from .blueprints.dashboards import dashboards_bp
 from .blueprints.reception import reception_bp
@@ -25,6 +26,7 @@ def create_app(config_class: type[Config] = Config) -> Flask:
     login_manager.login_message = "Faça login para continuar."
 
     register_blueprints(app)
+    register_error_handlers(app)
 
     @app.context_processor
     def inject_template_globals():
@@ -53,6 +55,21 @@ def create_app(config_class: type[Config] = Config) -> Flask:
     return app
 
 
+def register_error_handlers(app: Flask) -> None:
+    @app.errorhandler(PoolOcupadoError)
+    def pool_ocupado(exc: PoolOcupadoError):
+        """Pool de conexões saturado: responde 503 para o cliente tentar de novo."""
+        app.logger.warning("Requisição recusada por falta de conexão: %s", exc)
+        mensagem = "Sistema ocupado no momento. Tente novamente em instantes."
+        if request.accept_mimetypes.best == "application/json" or request.is_json:
+            resposta = jsonify({"error": mensagem})
+        else:
+            resposta = app.response_class(mensagem, mimetype="text/plain")
+        resposta.status_code = 503
+        resposta.headers["Retry-After"] = str(exc.retry_after)
+        return resposta
+
+
 def register_blueprints(app: Flask) -> None:
     app.register_blueprint(auth_bp)
     app.register_blueprint(dashboards_bp)
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from .bloom import FiltroBloom
+from .limites import CacheTTL, LimitadorTaxa
+from .utils.texto import somente_digitos
+
+logger = logging.getLogger(__name__)
+
+
+class ProtecaoAcompanhamento:
+    """
+    Proteções da consulta pública de acompanhamento (sem login):
+
+    * limite de requisições por IP (token bucket), para que um robô ou uma
+      fila no totem não esgote o pool de conexões;
+    * cache curto do resultado por CPF, invalidado quando
+      ``pedidos_service.atualizar_status`` altera um pedido do paciente;
+    * filtro de Bloom com os CPFs cadastrados, que responde "CPF inexistente"
+      sem ir ao MySQL.
+
+    Tudo é em memória, por processo: em outros workers a invalidação não
+    chega e o TTL curto limita por quanto tempo o resultado fica defasado.
+    """
+
+    def __init__(self):
+        self.limitador: Optional[LimitadorTaxa] = None
+        self.cache: Optional[CacheTTL] = None
+        self.cpfs: Optional[FiltroBloom] = None
+        self.intervalo_sincronia = 5.0
+        self.janela_sincronia = 1000
+        self._ultimo_paciente_id = 0
+        self._ultima_sincronia = 0.0
+        self._sincronizando = threading.Lock()
+        self.descartes = 0
+
+    def init_app(self, app) -> None:
+        por_minuto = app.config.get("ACOMPANHAMENTO_LIMITE_POR_MINUTO", 10)
+        if por_minuto > 0:
+            self.limitador = LimitadorTaxa(
+                capacidade=app.config.get("ACOMPANHAMENTO_RAJADA", 5),
+                taxa=por_minuto / 60.0,
+                max_chaves=app.config.get("ACOMPANHAMENTO_MAX_IPS", 10000),
+            )
+        ttl = app.config.get("ACOMPANHAMENTO_CACHE_TTL", 30)
+        if ttl > 0:
+            self.cache = CacheTTL(ttl, app.config.get("ACOMPANHAMENTO_CACHE_MAX", 2000))
+
+        capacidade = app.config.get("ACOMPANHAMENTO_BLOOM_CAPACIDADE", 200000)
+        if capacidade > 0:
+            self.intervalo_sincronia = app.config.get("ACOMPANHAMENTO_BLOOM_SINCRONIA", 5.0)
+            self.janela_sincronia = app.config.get("ACOMPANHAMENTO_BLOOM_JANELA", 1000)
+            try:
+                self._construir_filtro(capacidade, app.config.get("ACOMPANHAMENTO_BLOOM_FP", 0.01))
+            except Exception:
+                # Sem filtro a consulta continua correta, só mais cara.
+                self.cpfs = None
+                app.logger.exception("Falha ao montar o filtro de CPFs; consulta pública seguirá sem ele.")
+            else:
+                app.logger.info("Filtro de CPFs montado: %s", self.cpfs.estatisticas())
+
+    def _construir_filtro(self, capacidade: int, taxa_fp: float) -> None:
+        from app.repositories import pacientes as pacientes_repo
+
+        # Folga de 50% sobre o cadastro atual para os pacientes novos.
+        total = pacientes_repo.contar()
+        self.cpfs = FiltroBloom(max(capacidade, int(total * 1.5)), taxa_fp)
+        self._ultimo_paciente_id = 0
+        self._carregar_novos()
+
+    def _carregar_novos(self) -> None:
+        """
+        Lê os pacientes a partir do último id visto, recuando
+        ``janela_sincronia`` ids: o auto-incremento é atribuído no INSERT, mas
+        o commit pode vir fora de ordem (ex.: id 10 confirmado depois do 11
+        já lido), e sem o recuo esse CPF nunca entraria no filtro. Reinserir
+        um CPF no filtro não tem efeito.
+        """
+        from app.repositories import pacientes as pacientes_repo
+
+        ultimo = max(0, self._ultimo_paciente_id - self.janela_sincronia)
+        while True:
+            lote = pacientes_repo.listar_cpfs_desde(ultimo)
+            if not lote:
+                break
+            for paciente_id, cpf in lote:
+                self.cpfs.adicionar(cpf)
+            ultimo = lote[-1][0]
+        self._ultimo_paciente_id = max(self._ultimo_paciente_id, ultimo)
+        self._ultima_sincronia = time.monotonic()
+
+    def registrar_cpf(self, cpf: str) -> None:
+        """Chamado por ``pacientes.criar_paciente``; nada a fazer sem filtro."""
+        if self.cpfs is not None and cpf:
+            self.cpfs.adicionar(cpf)
+
+    def cpf_pode_existir(self, cpf: str) -> bool:
+        """
+        False só quando o CPF com certeza não está cadastrado. Pacientes
+        criados em outros processos entram no filtro local por uma leitura
+        incremental da PK (com recuo, ver ``_carregar_novos``), feita no
+        máximo a cada ``intervalo_sincronia``.
+        """
+        if self.cpfs is None or cpf in self.cpfs:
+            return True
+        if (
+            time.monotonic() - self._ultima_sincronia >= self.intervalo_sincronia
+            and self._sincronizando.acquire(blocking=False)
+        ):
+            try:
+                self._carregar_novos()
+            except Exception:
+                logger.exception("Falha ao sincronizar o filtro de CPFs.")
+                return True
+            finally:
+                self._sincronizando.release()
+            if cpf in self.cpfs:
+                return True
+        self.descartes += 1
+        return False
+
+    def permitir(self, ip: Optional[str]) -> tuple[bool, int]:
+        """(permitido, retry_after em segundos) para uma consulta vinda de ``ip``."""
+        if self.limitador is None:
+            return True, 0
+        permitido, retry_after = self.limitador.consumir(ip or "desconhecido")
+        if not permitido:
+            logger.info("Consulta de acompanhamento recusada para %s (limite por IP).", ip)
+        return permitido, retry_after
+
+    def consultar(self, cpf: str, carregar: Callable[[str], dict]) -> dict:
+        """
+        Resultado da consulta por ``cpf``: do cache ou de ``carregar(cpf)``.
+        ``carregar`` devolve um dict com ``paciente`` e ``pedidos``; o
+        resultado é etiquetado pelos pedidos para a invalidação.
+        """
+        if not self.cpf_pode_existir(cpf):
+            return {"paciente": None, "pedidos": []}
+        if self.cache is None:
+            return carregar(cpf)
+        resultado = self.cache.obter(cpf)
+        if resultado is None:
+            resultado = carregar(cpf)
+            etiquetas = [("pedido", pedido["id"]) for pedido in resultado.get("pedidos") or []]
+            paciente = resultado.get("paciente")
+            if paciente:
+                etiquetas.append(("paciente", paciente["id"]))
+            self.cache.guardar(cpf, resultado, etiquetas)
+        return resultado
+
+    def invalidar_pedido(self, pedido_id: int) -> None:
+        if self.cache is not None:
+            self.cache.invalidar_etiqueta(("pedido", pedido_id))
+
+    def invalidar_paciente(self, paciente_id: int) -> None:
+        if self.cache is not None:
+            self.cache.invalidar_etiqueta(("paciente", paciente_id))
+
+    def invalidar_cpf(self, cpf: str) -> None:
+        """
+        Descarta a consulta em cache do CPF. Necessário quando surge um pedido
+        novo: o resultado guardado não tem a etiqueta dele (e, se o paciente
+        ainda não existia, não tem etiqueta nenhuma).
+        """
+        if self.cache is not None and cpf:
+            self.cache.invalidar(somente_digitos(cpf))
+
+    def estatisticas(self) -> dict:
+        return {
+            "limitador": self.limitador.estatisticas() if self.limitador else None,
+            "cache": self.cache.estatisticas() if self.cache else None,
+            "filtro_cpfs": (
+                dict(self.cpfs.estatisticas(), descartes=self.descartes) if self.cpfs else None
+            ),
+        }
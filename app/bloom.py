@@ -0,0 +1,57 @@
+import hashlib
+import math
+import threading
+
+
+class FiltroBloom:
+    """
+    Filtro de Bloom: responde "com certeza não está" ou "talvez esteja".
+    Dimensionado para ``capacidade`` itens com taxa de falso positivo
+    ``taxa_fp``; acima da capacidade a taxa real sobe (ver ``estatisticas``).
+    Não há falso negativo para itens adicionados neste filtro.
+    """
+
+    def __init__(self, capacidade: int, taxa_fp: float = 0.01):
+        if capacidade <= 0 or not 0 < taxa_fp < 1:
+            raise ValueError("Capacidade deve ser positiva e taxa_fp entre 0 e 1.")
+        self.capacidade = capacidade
+        self.taxa_fp = taxa_fp
+        # m = -n·ln(p) / ln(2)²  e  k = (m/n)·ln(2)
+        self.bits = max(8, int(math.ceil(-capacidade * math.log(taxa_fp) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.bits / capacidade * math.log(2))))
+        self._mapa = bytearray((self.bits + 7) // 8)
+        self._lock = threading.Lock()
+        self.itens = 0
+
+    def _posicoes(self, item: str):
+        # Hashing duplo (Kirsch–Mitzenmacher): h1 + i·h2 dá os k índices
+        resumo = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(resumo[:8], "little")
+        h2 = int.from_bytes(resumo[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def adicionar(self, item: str) -> None:
+        posicoes = self._posicoes(item)
+        with self._lock:
+            for posicao in posicoes:
+                self._mapa[posicao >> 3] |= 1 << (posicao & 7)
+            self.itens += 1
+
+    def __contains__(self, item: str) -> bool:
+        mapa = self._mapa
+        return all(mapa[p >> 3] & (1 << (p & 7)) for p in self._posicoes(item))
+
+    def taxa_fp_estimada(self) -> float:
+        """(1 - e^(-k·n/m))^k para o número de itens já adicionados."""
+        return (1 - math.exp(-self.hashes * self.itens / self.bits)) ** self.hashes
+
+    def estatisticas(self) -> dict:
+        return {
+            "capacidade": self.capacidade,
+            "itens": self.itens,
+            "bits": self.bits,
+            "bytes": len(self._mapa),
+            "hashes": self.hashes,
+            "taxa_fp_configurada": self.taxa_fp,
+            "taxa_fp_estimada": round(self.taxa_fp_estimada(), 6),
+        }
@@ -4,10 +4,11 @@ import re
 from datetime import datetime
 from typing import Optional
 
-from flask import flash, redirect, render_template, request, url_for
+from flask import flash, jsonify, redirect, render_template, request, url_for
 from flask_login import login_required
 from werkzeug.security import generate_password_hash
 
+from app.extensions import acompanhamento, mysql
 from app.repositories import exames as exames_repo
 from app.repositories import unidades as unidades_repo
 from app.repositories import usuarios as usuarios_repo
@@ -521,4 +522,43 @@ def alterar_status_consulta(consulta_id: int):
 
     mensagem = "Especialidade ativada com sucesso." if nova_situacao else "Especialidade desativada com sucesso."
     flash(mensagem, "success")
-    return redirect(url_for("admin.listar_consultas"))
\ No newline at end of file
+    return redirect(url_for("admin.listar_consultas"))
+
+
+@admin_bp.route("/diagnostico/pool")
+@login_required
+@roles_required("admin")
+def diagnostico_pool():
+    """Telemetria do pool de conexões MySQL (uso, espera, retenção por origem)."""
+    return jsonify(mysql.estatisticas())
+
+
+@admin_bp.route("/diagnostico/acompanhamento")
+@login_required
+@roles_required("admin")
+def diagnostico_acompanhamento():
+    """Contadores da consulta pública: recusas do limite por IP e acertos do cache por CPF."""
+    return jsonify(acompanhamento.estatisticas())
+
+
+@admin_bp.route("/diagnostico/consultas-lentas")
+@login_required
+@roles_required("admin")
+def consultas_lentas():
+    slowlog = mysql.slowlog
+    return render_template(
+        "admin/diagnostico/consultas_lentas.html",
+        ativo=slowlog is not None,
+        limite_ms=slowlog.limite * 1000 if slowlog else 0,
+        consultas=slowlog.piores() if slowlog else [],
+    )
+
+
+@admin_bp.route("/diagnostico/consultas-lentas/limpar", methods=["POST"])
+@login_required
+@roles_required("admin")
+def limpar_consultas_lentas():
+    if mysql.slowlog is not None:
+        mysql.slowlog.limpar()
+        flash("Registro de consultas lentas limpo.", "success")
+    return redirect(url_for("admin.consultas_lentas"))
\ No newline at end of file
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
+from app.database import POOL_CHAT
 from app.extensions import mysql
 from datetime import datetime, timedelta
 import os
@@ -13,6 +14,8 @@ UPLOAD_FOLDER = "app/static/uploads"
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "pdf", "docx", "txt", "xlsx", "xls", "zip", "rar"}
 
 chat_blueprint = Blueprint("chat", __name__)
+# Chat, presença e heartbeats não disputam conexões com o fluxo de regulação
+mysql.registrar_pool_blueprint(chat_blueprint, POOL_CHAT)
 
 # ---------------------------------------
 # Funções auxiliares CORRIGIDAS
@@ -289,7 +292,7 @@ def get_users():
 @chat_blueprint.route("/chat/conversas")
 @login_required
 def list_conversations():
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute("""
             SELECT 
                 c.id,
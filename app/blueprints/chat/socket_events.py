@@ -1,5 +1,6 @@
 from flask_socketio import emit, join_room
 from flask_login import current_user
+from app.database import POOL_CHAT
 from app.extensions import socketio, mysql
 import json
 
@@ -7,7 +8,7 @@ import json
 def on_connect():
     if current_user.is_authenticated:
         try:
-            with mysql.get_cursor() as (conn, cursor):
+            with mysql.get_cursor(pool=POOL_CHAT) as (conn, cursor):
                 cursor.execute("""
                     UPDATE usuarios 
                     SET is_online = TRUE, last_seen = NOW()
@@ -30,7 +31,7 @@ def on_connect():
 def on_disconnect():
     if current_user.is_authenticated:
         try:
-            with mysql.get_cursor() as (conn, cursor):
+            with mysql.get_cursor(pool=POOL_CHAT) as (conn, cursor):
                 cursor.execute("""
                     UPDATE usuarios 
                     SET is_online = FALSE, last_seen = NOW()
@@ -53,7 +54,7 @@ def on_disconnect():
 def on_heartbeat():
     if current_user.is_authenticated:
         try:
-            with mysql.get_cursor() as (conn, cursor):
+            with mysql.get_cursor(pool=POOL_CHAT) as (conn, cursor):
                 cursor.execute("""
                     UPDATE usuarios 
                     SET last_seen = NOW()
@@ -89,7 +90,7 @@ def handle_send_message(data):
         user_name = current_user.nome if current_user.is_authenticated else "Anônimo"
 
         # Salvar mensagem + anexos no banco
-        with mysql.get_cursor(dictionary=True) as (conn, cursor):
+        with mysql.get_cursor(dictionary=True, pool=POOL_CHAT) as (conn, cursor):
             cursor.execute(
                 """
                 INSERT INTO messages (conversation_id, user_id, message, created_at)
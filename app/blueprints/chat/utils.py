@@ -1,8 +1,9 @@
+from app.database import POOL_CHAT
 from app.extensions import mysql
 
 def get_or_create_private_conversation(user_id_1: int, user_id_2: int):
     """Obtém ou cria uma conversa privada entre dois usuários."""
-    with mysql.get_cursor(dictionary=True) as (conn, cursor):
+    with mysql.get_cursor(dictionary=True, pool=POOL_CHAT) as (conn, cursor):
         # Verifica se já existe uma conversa entre esses dois usuários
         cursor.execute("""
             SELECT c.id, c.room
@@ -1,5 +1,6 @@
 from flask import redirect, url_for, render_template
 from flask_login import current_user, login_required
+from app.database import POOL_RELATORIOS
 from app.extensions import mysql
 from datetime import datetime, timedelta
 
@@ -8,7 +9,7 @@ from . import dashboards_bp
 
 def _get_dashboard_stats():
     """Busca estatísticas gerais do sistema"""
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, pool=POOL_RELATORIOS, readonly=True) as (_, cursor):
         stats = {}
         
         # Estatísticas de pedidos
@@ -81,7 +82,7 @@ def _get_dashboard_stats():
 
 def _get_role_specific_stats(role):
     """Busca estatísticas específicas por perfil"""
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, pool=POOL_RELATORIOS, readonly=True) as (_, cursor):
         stats = {}
         
         if role == "admin":
@@ -170,7 +171,7 @@ def relatorios():
         return redirect(url_for("dashboards.home"))
     
     # Buscar dados para relatórios
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, pool=POOL_RELATORIOS, readonly=True) as (_, cursor):
         relatorios = {}
         
         # Relatório de pedidos por período
@@ -4,67 +4,74 @@ from flask_login import login_required, current_user
 from app.domain.status import StatusPedido
 from app.repositories import pedidos as pedidos_repo
 from app.services.pedidos_service import atualizar_status
+from app.utils.conflitos import responder_conflito, versao_do_form
 from app.utils.decorators import roles_required
+from app.utils.paginacao import limite_da_requisicao
 from . import malote_bp
 
 
+def _filtros_da_query() -> dict:
+    return {
+        'unidade': request.args.get('unidade', type=int),
+        'categoria': request.args.get('categoria', '').strip(),
+        'cpf': request.args.get('cpf', '').strip(),
+        'nome': request.args.get('nome', '').strip(),
+    }
+
+
+def _url_lista(filtros: dict) -> str:
+    return url_for("malote.listar", **{k: v for k, v in filtros.items() if v})
+
+
+def _redirect_lista(filtros: dict):
+    """Volta para a fila mantendo os filtros ativos."""
+    return redirect(_url_lista(filtros))
+
+
+def _responder_conflito(erro: pedidos_repo.ConflitoVersao, filtros: dict):
+    """Outro usuário alterou o pedido: redesenha só a linha dele na fila."""
+
+    def linha() -> str:
+        pedido = pedidos_repo.obter_linha_fila(erro.pedido_id)
+        if not pedido:
+            return ""
+        return render_template(
+            "malote/_linha.html",
+            pedido=pedido,
+            filtros=filtros,
+            conflito=str(erro),
+            acionavel=pedido["status"] in pedidos_repo.STATUS_MALOTE,
+        )
+
+    return responder_conflito(erro, _url_lista(filtros), linha)
+
+
 @malote_bp.route("/pedidos")
 @login_required
 @roles_required("malote", "admin")
 def listar():
-    # Obter parâmetros de filtro da query string
-    unidade = request.args.get('unidade', '').strip()
-    categoria = request.args.get('categoria', '').strip()
-    cpf = request.args.get('cpf', '').strip()
-    nome = request.args.get('nome', '').strip()
-    
-    # Listar todos os pedidos (repository atual não aceita filtros)
-    pedidos = pedidos_repo.listar_para_malote()
-    
-    # Filtrar no Python se há parâmetros de filtro
-    if unidade or categoria or cpf or nome:
-        pedidos_filtrados = []
-        
-        for pedido in pedidos:
-            incluir = True
-            
-            # Filtro por unidade
-            if unidade and unidade.lower() not in pedido.get('unidade_nome', '').lower():
-                incluir = False
-                
-            # Filtro por categoria
-            if categoria and pedido.get('tipo_solicitacao') != categoria:
-                incluir = False
-                
-            # Filtro por CPF
-            if cpf:
-                cpf_limpo = ''.join(filter(str.isdigit, cpf))
-                pedido_cpf_limpo = ''.join(filter(str.isdigit, pedido.get('paciente_cpf', '')))
-                if cpf_limpo not in pedido_cpf_limpo:
-                    incluir = False
-                    
-            # Filtro por nome
-            if nome and nome.lower() not in pedido.get('paciente_nome', '').lower():
-                incluir = False
-                
-            if incluir:
-                pedidos_filtrados.append(pedido)
-                
-        pedidos = pedidos_filtrados
-    
-    # Obter lista de unidades para o dropdown
-    unidades_disponiveis = sorted(list(set(p.get('unidade_nome', '') for p in pedidos_repo.listar_para_malote() if p.get('unidade_nome'))))
-    
-    # Dados para o template
+    filtros = _filtros_da_query()
+
+    # Filtros, ordenação e paginação resolvidos no SQL
+    pedidos = pedidos_repo.listar_para_malote(
+        unidade_id=filtros['unidade'],
+        categoria=filtros['categoria'] or None,
+        cpf=filtros['cpf'],
+        nome=filtros['nome'],
+        limite=limite_da_requisicao(),
+        cursor=request.args.get('cursor'),
+    )
+
+    # Dropdown: agregado por unidade sobre o índice (status, unidade_id)
+    unidades_disponiveis = pedidos_repo.contar_malote_por_unidade()
+    nomes_unidades = {u['id']: u['nome'] for u in unidades_disponiveis}
+
     template_data = {
         'pedidos': pedidos,
-        'filtros': {
-            'unidade': unidade,
-            'categoria': categoria,
-            'cpf': cpf,
-            'nome': nome
-        },
-        'unidades_disponiveis': unidades_disponiveis
+        'filtros': filtros,
+        'unidade_nome': nomes_unidades.get(filtros['unidade']),
+        'unidades_disponiveis': unidades_disponiveis,
+        'total_fila': sum(u['total'] for u in unidades_disponiveis),
     }
     
     return render_template("malote/list.html", **template_data)
@@ -82,23 +89,14 @@ def classificar(pedido_id: int):
         'unidade': request.form.get('filtro_unidade', ''),
         'categoria': request.form.get('filtro_categoria', ''),
         'cpf': request.form.get('filtro_cpf', ''),
-        'nome': request.form.get('filtro_nome', '')
+        'nome': request.form.get('filtro_nome', ''),
+        'limite': request.form.get('filtro_limite', ''),
+        'cursor': request.form.get('filtro_cursor', ''),
     }
     
     if tipo_regulacao not in ("municipal", "estadual") or prioridade not in ("P1", "P2"):
         flash("Selecione tipo de regulação e prioridade válidos.", "danger")
-        
-        # Redirecionar mantendo filtros
-        params = []
-        for key, value in filtros_ativos.items():
-            if value:
-                params.append(f"{key}={value}")
-        
-        redirect_url = url_for("malote.listar")
-        if params:
-            redirect_url += "?" + "&".join(params)
-            
-        return redirect(redirect_url)
+        return _redirect_lista(filtros_ativos)
 
     status_destino = (
         StatusPedido.AGUARDANDO_ANALISE_MEDICO_MUNICIPAL
@@ -106,30 +104,25 @@ def classificar(pedido_id: int):
         else StatusPedido.AGUARDANDO_ANALISE_MEDICO_ESTADUAL
     )
 
-    atualizar_status(
-        pedido_id=pedido_id,
-        status=status_destino,
-        usuario_id=current_user.id,
-        descricao=f"Pedido encaminhado ao médico regulador ({tipo_regulacao.upper()}) com prioridade {prioridade}.",
-        extra_campos={
-            "tipo_regulacao": tipo_regulacao,
-            "prioridade": prioridade,
-            "pendente_recepcao": 0,
-        },
-    )
+    try:
+        atualizar_status(
+            pedido_id=pedido_id,
+            status=status_destino,
+            usuario_id=current_user.id,
+            descricao=f"Pedido encaminhado ao médico regulador ({tipo_regulacao.upper()}) com prioridade {prioridade}.",
+            extra_campos={
+                "tipo_regulacao": tipo_regulacao,
+                "prioridade": prioridade,
+                "pendente_recepcao": 0,
+            },
+            versao=versao_do_form(),
+        )
+    except pedidos_repo.ConflitoVersao as erro:
+        return _responder_conflito(erro, filtros_ativos)
     flash("Pedido encaminhamento ao médico regulador.", "success")
     
     # Redirecionar mantendo filtros ativos
-    params = []
-    for key, value in filtros_ativos.items():
-        if value:
-            params.append(f"{key}={value}")
-    
-    redirect_url = url_for("malote.listar")
-    if params:
-        redirect_url += "?" + "&".join(params)
-        
-    return redirect(redirect_url)
+    return _redirect_lista(filtros_ativos)
 
 
 @malote_bp.route("/pedidos/limpar-filtros")
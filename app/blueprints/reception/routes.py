@@ -1,18 +1,25 @@
 from datetime import date, datetime, timedelta
 from typing import Any, Dict, Optional
 
-from flask import render_template, request, redirect, url_for, flash, abort
+from flask import current_app, render_template, request, redirect, url_for, flash, abort, make_response, stream_template
 from flask_login import login_required, current_user
 from urllib.parse import urlparse
 
 from app.domain.status import StatusPedido
+from app.extensions import acompanhamento
 from app.repositories import pacientes as pacientes_repo
 from app.repositories import pedidos as pedidos_repo
 from app.repositories import exames as exames_repo
 from app.repositories import unidades as unidades_repo
 from app.repositories import consultas as consultas_repo
-from app.services.pedidos_service import atualizar_status, registrar_historico
+from app.services.pedidos_service import (
+    atualizar_status,
+    invalidar_acompanhamento_cpf,
+    registrar_historico,
+    transicao,
+)
 from app.utils.decorators import roles_required
+from app.utils.paginacao import limite_da_requisicao
 from . import reception_bp
 
 
@@ -129,8 +136,11 @@ def _determinar_unidade_id(unidades: list[dict]) -> Optional[int]:
 @login_required
 @roles_required("recepcao", "admin")
 def listar_pedidos():
+    limite = limite_da_requisicao()
+    cursor = request.args.get("cursor")
+
     if current_user.role == "admin":
-        pedidos = pedidos_repo.listar_todos() or []
+        pedidos = pedidos_repo.listar_todos_paginado(limite, cursor)
         pedidos_devolvidos = pedidos_repo.listar_devolvidos_todas_unidades() or []
     else:
         unidade_id = current_user.unidade_id
@@ -139,7 +149,7 @@ def listar_pedidos():
             flash("Usuário de recepção sem unidade vinculada. Contate o administrador.", "danger")
             return redirect(url_for("dashboards.home"))
         
-        pedidos = pedidos_repo.listar_por_unidade(unidade_id)
+        pedidos = pedidos_repo.listar_por_unidade(unidade_id, limite, cursor)
         pedidos_devolvidos = pedidos_repo.listar_devolvidos_por_unidade(unidade_id)
     
     return render_template(
@@ -262,14 +272,18 @@ def novo_pedido():
                 "observacoes": observacoes,
             }
 
-        pedido_id = pedidos_repo.criar_pedido(dados_pedido)
-
-        registrar_historico(
-            pedido_id=pedido_id,
-            status=StatusPedido.AGUARDANDO_TRIAGEM,
-            descricao=f"Pedido de {tipo_solicitacao} criado pela {current_user.role}.",
-            usuario_id=current_user.id,
-        )
+        # criar_pedido entra na transação aberta aqui: pedido e primeiro
+        # registro do histórico são gravados no mesmo commit
+        with transicao() as cursor:
+            pedido_id = pedidos_repo.criar_pedido(dados_pedido)
+            registrar_historico(
+                pedido_id=pedido_id,
+                status=StatusPedido.AGUARDANDO_TRIAGEM,
+                descricao=f"Pedido de {tipo_solicitacao} criado pela {current_user.role}.",
+                usuario_id=current_user.id,
+                cursor=cursor,
+            )
+            invalidar_acompanhamento_cpf(paciente_data["cpf"])
         flash(f"Pedido de {tipo_solicitacao} criado e enviado para triagem.", "success")
         return redirect(url_for("reception.listar_pedidos"))
 
@@ -354,29 +368,27 @@ def tratar_devolucao(pedido_id: int):
             flash("Descreva a tratativa realizada.", "danger")
             return redirect(url_for("reception.tratar_devolucao", pedido_id=pedido_id))
 
-        registrar_historico(
-            pedido_id=pedido_id,
-            status=StatusPedido.DEVOLVIDO_PELO_MEDICO,
-            descricao=f"Tratativa da {current_user.role}: {tratativa}",
-            usuario_id=current_user.id,
-        )
-        pedidos_repo.atualizar_campos(
-            pedido_id,
-            {
-                "status": StatusPedido.AGUARDANDO_TRIAGEM.value,
-                "tipo_regulacao": None,
-                "prioridade": None,
-                "pendente_recepcao": 0,
-                "motivo_devolucao": None,
-                "usuario_atualizacao": current_user.id,
-            },
-        )
-        registrar_historico(
-            pedido_id=pedido_id,
-            status=StatusPedido.AGUARDANDO_TRIAGEM,
-            descricao="Pedido reenviado à triagem após tratativa.",
-            usuario_id=current_user.id,
-        )
+        # Tratativa e reenvio à triagem gravam juntos ou não gravam
+        with transicao() as cursor:
+            registrar_historico(
+                pedido_id=pedido_id,
+                status=StatusPedido.DEVOLVIDO_PELO_MEDICO,
+                descricao=f"Tratativa da {current_user.role}: {tratativa}",
+                usuario_id=current_user.id,
+                cursor=cursor,
+            )
+            atualizar_status(
+                pedido_id=pedido_id,
+                status=StatusPedido.AGUARDANDO_TRIAGEM,
+                usuario_id=current_user.id,
+                descricao="Pedido reenviado à triagem após tratativa.",
+                extra_campos={
+                    "tipo_regulacao": None,
+                    "prioridade": None,
+                    "motivo_devolucao": None,
+                },
+                cursor=cursor,
+            )
         flash("Tratativa registrada e pedido reenviado ao malote.", "success")
         return redirect(url_for("reception.listar_pedidos"))
 
@@ -464,31 +476,54 @@ def acompanhar_pedido():
     """Consulta pública para acompanhamento de pedidos por CPF"""
     pedidos_paciente = []
     cpf_consulta = None
+    status_http = 200
+    retry_after = 0
     
     if request.method == "POST":
         cpf_consulta = (request.form.get("cpf") or "").strip()
+        permitido, retry_after = acompanhamento.permitir(request.remote_addr)
         
-        if not cpf_consulta:
+        if not permitido:
+            flash(f"Muitas consultas em sequência. Aguarde {retry_after}s e tente novamente.", "warning")
+            status_http = 429
+        elif not cpf_consulta:
             flash("Informe o CPF para consulta.", "warning")
         elif len(cpf_consulta) != 11 or not cpf_consulta.isdigit():
             flash("CPF deve conter exatamente 11 dígitos.", "danger")
         else:
-            paciente = pacientes_repo.obter_por_cpf(cpf_consulta)
+            resultado = acompanhamento.consultar(cpf_consulta, _carregar_acompanhamento)
             
-            if not paciente:
+            if not resultado["paciente"]:
                 flash("Nenhum pedido encontrado para este CPF.", "info")
             else:
-                pedidos_paciente = pedidos_repo.listar_por_paciente(paciente["id"])
-                
-                for pedido in pedidos_paciente:
-                    pedido["historico"] = pedidos_repo.obter_historico(pedido["id"])
-                    pedido["horario_exame"] = _to_time(pedido.get("horario_exame"))
+                pedidos_paciente = resultado["pedidos"]
     
-    return render_template(
-        "reception/acompanhamento.html", 
-        pedidos=pedidos_paciente,
-        cpf_consulta=cpf_consulta
+    resposta = make_response(
+        render_template(
+            "reception/acompanhamento.html", 
+            pedidos=pedidos_paciente,
+            cpf_consulta=cpf_consulta
+        ),
+        status_http,
     )
+    if status_http == 429:
+        resposta.headers["Retry-After"] = str(retry_after)
+    return resposta
+
+
+def _carregar_acompanhamento(cpf: str) -> dict:
+    """Paciente e pedidos (com histórico) de um CPF; resultado guardado no cache da consulta pública."""
+    paciente = pacientes_repo.obter_por_cpf(cpf)
+    if not paciente:
+        return {"paciente": None, "pedidos": []}
+    
+    pedidos_paciente = pedidos_repo.listar_por_paciente(paciente["id"])
+    historicos = pedidos_repo.obter_historicos([p["id"] for p in pedidos_paciente])
+    
+    for pedido in pedidos_paciente:
+        pedido["historico"] = historicos.get(pedido["id"], [])
+        pedido["horario_exame"] = _to_time(pedido.get("horario_exame"))
+    return {"paciente": {"id": paciente["id"]}, "pedidos": pedidos_paciente}
 
 
 # ============================================================================
@@ -501,85 +536,105 @@ def regulacao():
     """Lista pedidos para recepção de regulação"""
     
     # Filtros da URL
-    filtros = {}
-    cpf = request.args.get("cpf", "").strip()
-    nome = request.args.get("nome", "").strip()
-    unidade = request.args.get("unidade", "").strip()
-    categoria = request.args.get("categoria", "").strip()
-    
-    # Buscar todos os pedidos inicialmente
-    pedidos = pedidos_repo.listar_todos() or []
-    
-    # Se não há filtros, mostrar apenas pedidos agendados
-    if not (cpf or nome or unidade or categoria):
-        pedidos = [p for p in pedidos if 'AGENDADO' in p.get('status', '').upper() or 'CONFIRMADO' in p.get('status', '').upper()]
-    
-    # Aplicar filtros específicos
-    if cpf:
-        cpf_clean = cpf.replace(".", "").replace("-", "")
-        pedidos = [p for p in pedidos if (p.get("paciente_cpf") or "").replace(".", "").replace("-", "") == cpf_clean]
-        filtros["cpf"] = cpf
-    
-    if nome:
-        pedidos = [p for p in pedidos if nome.lower() in (p.get("paciente_nome") or "").lower()]
-        filtros["nome"] = nome
-    
-    if unidade:
-        pedidos = [p for p in pedidos if p.get("unidade_nome") == unidade]
-        filtros["unidade"] = unidade
+    filtros = {
+        "cpf": request.args.get("cpf", "").strip(),
+        "nome": request.args.get("nome", "").strip(),
+        "unidade": request.args.get("unidade", type=int),
+        "categoria": request.args.get("categoria", "").strip(),
+    }
     
-    if categoria:
-        if categoria == "exame":
-            pedidos = [p for p in pedidos if p.get("tipo_solicitacao") == "exame"]
-        elif categoria == "consulta":
-            pedidos = [p for p in pedidos if p.get("tipo_solicitacao") == "consulta"]
-        filtros["categoria"] = categoria
+    # Status fixos (STATUS_REGULACAO_RECEPCAO); demais filtros resolvidos no SQL
+    pedidos = pedidos_repo.listar_para_regulacao(
+        unidade_id=filtros["unidade"],
+        categoria=filtros["categoria"] or None,
+        cpf=filtros["cpf"],
+        nome=filtros["nome"],
+        limite=limite_da_requisicao(),
+        cursor=request.args.get("cursor"),
+    )
     
     # Unidades para dropdown
-    todos_pedidos = pedidos_repo.listar_todos() or []
-    unidades_disponiveis = sorted(set(p.get("unidade_nome") for p in todos_pedidos if p.get("unidade_nome")))
+    unidades_disponiveis = pedidos_repo.contar_regulacao_por_unidade()
+    nomes_unidades = {u["id"]: u["nome"] for u in unidades_disponiveis}
     
     return render_template(
         "reception/regulacao.html",
         pedidos=pedidos,
         filtros=filtros,
+        unidade_nome=nomes_unidades.get(filtros["unidade"]),
         unidades_disponiveis=unidades_disponiveis,
     )
 
 
+@reception_bp.route("/folhas")
+@login_required
+@roles_required("recepcao_regulacao", "admin")
+def folhas_lote():
+    """
+    Impressão em lote: ``?ids=1,2,3`` ou um filtro (``unidade``, ``data``,
+    padrão: confirmados hoje). Os agregados são carregados em blocos de
+    FOLHAS_LOTE_BLOCO pedidos (duas consultas por bloco) enquanto o
+    documento é transmitido.
+    """
+    maximo = current_app.config.get("FOLHAS_LOTE_MAXIMO", 500)
+    bloco = current_app.config.get("FOLHAS_LOTE_BLOCO", 200)
+
+    ids_texto = ",".join(request.args.getlist("ids"))
+    if ids_texto:
+        try:
+            pedido_ids = [int(i) for i in ids_texto.split(",") if i.strip()]
+        except ValueError:
+            abort(400)
+        if len(pedido_ids) > maximo:
+            flash(f"Selecione no máximo {maximo} pedidos por impressão.", "warning")
+            return redirect(url_for("reception.regulacao"))
+        filtro_descricao = f"{len(pedido_ids)} pedido(s) selecionado(s)"
+    else:
+        dia = date.today()
+        if request.args.get("data"):
+            try:
+                dia = datetime.strptime(request.args["data"], "%Y-%m-%d").date()
+            except ValueError:
+                abort(400)
+        unidade_id = request.args.get("unidade", type=int)
+        pedido_ids = pedidos_repo.ids_para_impressao(unidade_id=unidade_id, dia=dia, limite=maximo)
+        filtro_descricao = f"Agendamentos confirmados em {dia.strftime('%d/%m/%Y')}"
+
+    def folhas():
+        for inicio in range(0, len(pedido_ids), bloco):
+            for folha in pedidos_repo.obter_folhas(pedido_ids[inicio:inicio + bloco]):
+                folha["pedido"]["horario_exame"] = _to_time(folha["pedido"].get("horario_exame"))
+                yield folha
+
+    return stream_template(
+        "reception/folhasLote.html",
+        folhas=folhas(),
+        total=len(pedido_ids),
+        filtro_descricao=filtro_descricao,
+    )
+
+
 @reception_bp.route("/pedidos/<int:pedido_id>/folha")
 @login_required
 @roles_required("recepcao_regulacao", "admin")
 def folha_impressao(pedido_id: int):
     """Página imprimível com todos os dados do paciente e do pedido."""
-    pedido = pedidos_repo.obter_por_id(pedido_id)
-    if not pedido:
+    folha = pedidos_repo.obter_folha(pedido_id)
+    if not folha:
         abort(404)
 
+    pedido = folha["pedido"]
     if current_user.role == "recepcao" and pedido.get("unidade_id") != current_user.unidade_id:
         abort(403)
 
-    paciente = pacientes_repo.obter_por_id(pedido.get("paciente_id")) or {}
-    exame = None
-    consulta = None
-    if pedido.get("exame_id"):
-        exame = exames_repo.obter_por_id(pedido.get("exame_id"))
-    if pedido.get("consulta_id"):
-        consulta = consultas_repo.obter_por_id(pedido.get("consulta_id"))
-
-    unidade = None
-    if pedido.get("unidade_id"):
-        unidade = unidades_repo.obter_por_id(pedido.get("unidade_id"))
-
     pedido["horario_exame"] = _to_time(pedido.get("horario_exame"))
-    historico = pedidos_repo.obter_historico(pedido_id)
 
     return render_template(
         "reception/folhaImpressao.html",
         pedido=pedido,
-        paciente=paciente,
-        exame=exame,
-        consulta=consulta,
-        unidade=unidade,
-        historico=historico,
+        paciente=folha["paciente"] or {},
+        exame=folha["exame"],
+        consulta=folha["consulta"],
+        unidade=folha["unidade"],
+        historico=folha["historico"],
     )
\ No newline at end of file
@@ -1,13 +1,67 @@
-from flask import render_template, request, redirect, url_for, flash, abort, session
+from flask import current_app, jsonify, render_template, request, redirect, url_for, flash, abort, session
 from flask_login import login_required, current_user
 
 from app.domain.status import StatusPedido
 from app.repositories import pedidos as pedidos_repo
 from app.services.pedidos_service import atualizar_status
+from app.utils.conflitos import requisicao_fetch, responder_conflito, versao_do_form
 from app.utils.decorators import roles_required
+from app.utils.paginacao import limite_da_requisicao
 from . import regulator_bp
 
 
+def _filtros_do_form() -> dict:
+    """Filtros ativos enviados junto das ações, para voltar à mesma visão do painel."""
+    return {
+        'unidade': request.form.get('filtro_unidade', ''),
+        'categoria': request.form.get('filtro_categoria', ''),
+        'cpf': request.form.get('filtro_cpf', ''),
+        'nome': request.form.get('filtro_nome', ''),
+        'limite': request.form.get('filtro_limite', ''),
+        'cursor': request.form.get('filtro_cursor', ''),
+    }
+
+
+def _url_painel(tipo_regulacao: str, filtros: dict) -> str:
+    params = {k: v for k, v in filtros.items() if v}
+    return url_for("regulator.painel", tipo=tipo_regulacao, **params)
+
+
+def _redirect_painel(tipo_regulacao: str, filtros: dict):
+    return redirect(_url_painel(tipo_regulacao, filtros))
+
+
+_STATUS_FILA = {
+    "municipal": StatusPedido.AGUARDANDO_ANALISE_MEDICO_MUNICIPAL.value,
+    "estadual": StatusPedido.AGUARDANDO_ANALISE_MEDICO_ESTADUAL.value,
+}
+
+
+def _reservado_para():
+    """Ações sobre pedido reservado a outro regulador são recusadas (o admin passa)."""
+    return None if current_user.role == "admin" else current_user.id
+
+
+def _responder_conflito(erro: pedidos_repo.ConflitoVersao, tipo_regulacao: str, filtros: dict):
+    """Outro usuário alterou o pedido: redesenha só a linha dele no painel."""
+
+    def linha() -> str:
+        pedido = pedidos_repo.obter_linha_fila(erro.pedido_id)
+        if not pedido:
+            return ""
+        return render_template(
+            "regulator/_linha.html",
+            pedido=pedido,
+            tipo=tipo_regulacao,
+            filtros=filtros,
+            conflito=str(erro),
+            acionavel=pedido["status"] == _STATUS_FILA.get(tipo_regulacao)
+            and not isinstance(erro, pedidos_repo.PedidoReservado),
+        )
+
+    return responder_conflito(erro, _url_painel(tipo_regulacao, filtros), linha)
+
+
 @regulator_bp.route("/definir-preferencia-tipo", methods=["POST"])
 @login_required
 @roles_required("medico_regulador", "malote", "admin")
@@ -41,65 +95,77 @@ def painel():
         tipo = session.get('tipo_regulacao_preferido', 'municipal')
     
     # Obter parâmetros de filtro da query string
-    unidade = request.args.get('unidade', '').strip()
-    categoria = request.args.get('categoria', '').strip()
-    cpf = request.args.get('cpf', '').strip()
-    nome = request.args.get('nome', '').strip()
-    
-    # Buscar pedidos do tipo especificado
-    pedidos = pedidos_repo.listar_para_medico(tipo)
+    filtros = {
+        'unidade': request.args.get('unidade', type=int),
+        'categoria': request.args.get('categoria', '').strip(),
+        'cpf': request.args.get('cpf', '').strip(),
+        'nome': request.args.get('nome', '').strip(),
+    }
     
-    # Filtrar pedidos se houver parâmetros
-    if unidade or categoria or cpf or nome:
-        pedidos_filtrados = []
-        
-        for pedido in pedidos:
-            incluir = True
-            
-            # Filtro por unidade
-            if unidade and unidade.lower() not in pedido.get('unidade_nome', '').lower():
-                incluir = False
-                
-            # Filtro por categoria (tipo_solicitacao)
-            if categoria and pedido.get('tipo_solicitacao') != categoria:
-                incluir = False
-                
-            # Filtro por CPF
-            if cpf:
-                cpf_limpo = ''.join(filter(str.isdigit, cpf))
-                pedido_cpf_limpo = ''.join(filter(str.isdigit, pedido.get('paciente_cpf', '')))
-                if cpf_limpo not in pedido_cpf_limpo:
-                    incluir = False
-                    
-            # Filtro por nome
-            if nome and nome.lower() not in pedido.get('paciente_nome', '').lower():
-                incluir = False
-                
-            if incluir:
-                pedidos_filtrados.append(pedido)
-                
-        pedidos = pedidos_filtrados
+    # Filtros, ordenação e paginação resolvidos no SQL
+    pedidos = pedidos_repo.listar_para_medico(
+        tipo,
+        unidade_id=filtros['unidade'],
+        categoria=filtros['categoria'] or None,
+        cpf=filtros['cpf'],
+        nome=filtros['nome'],
+        limite=limite_da_requisicao(),
+        cursor=request.args.get('cursor'),
+        usuario_id=current_user.id,
+    )
+
+    # Pedido que o regulador pegou com "Próximo pedido" (se a reserva não venceu)
+    reserva = pedidos_repo.reserva_ativa(tipo, current_user.id)
     
-    # Obter lista de unidades para o dropdown (apenas do tipo atual)
-    todos_pedidos_tipo = pedidos_repo.listar_para_medico(tipo)
-    unidades_disponiveis = sorted(list(set(p.get('unidade_nome', '') for p in todos_pedidos_tipo if p.get('unidade_nome'))))
+    # Dropdown de unidades com a contagem da fila (apenas do tipo atual)
+    unidades_disponiveis = pedidos_repo.contar_para_medico_por_unidade(tipo)
+    nomes_unidades = {u['id']: u['nome'] for u in unidades_disponiveis}
     
     # Preparar dados para o template
     return render_template(
         "regulator/painel.html", 
         pedidos=pedidos, 
+        reserva=reserva,
         tipo=tipo,
         preferencia_tipo=session.get('tipo_regulacao_preferido', 'municipal'),
-        filtros={
-            'unidade': unidade,
-            'categoria': categoria,
-            'cpf': cpf,
-            'nome': nome
-        },
-        unidades_disponiveis=unidades_disponiveis
+        filtros=filtros,
+        unidade_nome=nomes_unidades.get(filtros['unidade']),
+        unidades_disponiveis=unidades_disponiveis,
+        total_fila=sum(u['total'] for u in unidades_disponiveis),
     )
 
 
+@regulator_bp.route("/pedidos/proximo", methods=["POST"])
+@login_required
+@roles_required("medico_regulador", "malote", "admin")
+def proximo():
+    """Reserva para o regulador o próximo pedido da fila (ou renova a reserva atual)."""
+    tipo_regulacao = request.form.get("tipo_regulacao")
+    if tipo_regulacao not in ("municipal", "estadual"):
+        abort(400)
+
+    pedido_id = pedidos_repo.reservar_proximo_para_medico(
+        tipo_regulacao, current_user.id, current_app.config["REGULACAO_RESERVA_SEGUNDOS"]
+    )
+    if requisicao_fetch():
+        return jsonify({"pedido": pedidos_repo.obter_linha_fila(pedido_id) if pedido_id else None})
+
+    if pedido_id is None:
+        flash("Nenhum pedido aguardando análise.", "info")
+    return _redirect_painel(tipo_regulacao, _filtros_do_form())
+
+
+@regulator_bp.route("/pedidos/<int:pedido_id>/liberar", methods=["POST"])
+@login_required
+@roles_required("medico_regulador", "malote", "admin")
+def liberar(pedido_id: int):
+    """Devolve à fila o pedido reservado, sem tratá-lo."""
+    tipo_regulacao = request.form.get("tipo_regulacao", "municipal")
+    if pedidos_repo.liberar_reserva(pedido_id, current_user.id):
+        flash(f"Pedido #{pedido_id} devolvido à fila.", "info")
+    return _redirect_painel(tipo_regulacao, _filtros_do_form())
+
+
 @regulator_bp.route("/pedidos/<int:pedido_id>/aprovar", methods=["POST"])
 @login_required
 @roles_required("medico_regulador", "malote", "admin")
@@ -107,12 +173,7 @@ def aprovar(pedido_id: int):
     tipo_regulacao = request.form.get("tipo_regulacao")
     
     # Obter filtros ativos para manter na navegação após ação
-    filtros_ativos = {
-        'unidade': request.form.get('filtro_unidade', ''),
-        'categoria': request.form.get('filtro_categoria', ''),
-        'cpf': request.form.get('filtro_cpf', ''),
-        'nome': request.form.get('filtro_nome', '')
-    }
+    filtros_ativos = _filtros_do_form()
     
     if tipo_regulacao not in ("municipal", "estadual"):
         abort(400)
@@ -121,24 +182,23 @@ def aprovar(pedido_id: int):
         StatusPedido.APROVADO_MUNICIPAL if tipo_regulacao == "municipal" else StatusPedido.APROVADO_ESTADUAL
     )
     
-    atualizar_status(
-        pedido_id=pedido_id,
-        status=status_destino,
-        usuario_id=current_user.id,
-        descricao="Pedido aprovado pelo médico regulador.",
-        extra_campos={"pendente_recepcao": 0},
-    )
+    try:
+        atualizar_status(
+            pedido_id=pedido_id,
+            status=status_destino,
+            usuario_id=current_user.id,
+            descricao="Pedido aprovado pelo médico regulador.",
+            extra_campos={"pendente_recepcao": 0},
+            versao=versao_do_form(),
+            reservado_para=_reservado_para(),
+        )
+    except pedidos_repo.ConflitoVersao as erro:
+        return _responder_conflito(erro, tipo_regulacao, filtros_ativos)
     
     flash("Pedido aprovado e encaminhado aos agendadores.", "success")
     
     # Redirecionar mantendo filtros e tipo
-    params = [f"tipo={tipo_regulacao}"]
-    for key, value in filtros_ativos.items():
-        if value:
-            params.append(f"{key}={value}")
-    
-    redirect_url = url_for("regulator.painel") + "?" + "&".join(params)
-    return redirect(redirect_url)
+    return _redirect_painel(tipo_regulacao, filtros_ativos)
 
 
 @regulator_bp.route("/pedidos/<int:pedido_id>/cancelar", methods=["POST"])
@@ -154,48 +214,37 @@ def cancelar(pedido_id: int):
     motivos_checkbox = request.form.getlist("motivos_checkbox")
     
     # Obter filtros ativos para manter na navegação após ação
-    filtros_ativos = {
-        'unidade': request.form.get('filtro_unidade', ''),
-        'categoria': request.form.get('filtro_categoria', ''),
-        'cpf': request.form.get('filtro_cpf', ''),
-        'nome': request.form.get('filtro_nome', '')
-    }
+    filtros_ativos = _filtros_do_form()
     
     if not motivos_checkbox and not motivo_obs:
         flash("Selecione pelo menos um motivo ou adicione observações.", "danger")
         # Redirecionar mantendo filtros
-        params = [f"tipo={tipo_regulacao}"]
-        for key, value in filtros_ativos.items():
-            if value:
-                params.append(f"{key}={value}")
-        redirect_url = url_for("regulator.painel") + "?" + "&".join(params)
-        return redirect(redirect_url)
+        return _redirect_painel(tipo_regulacao, filtros_ativos)
 
     # Preparar texto dos checkboxes para motivo_cancelamento (compatibilidade)
     texto_motivos = ", ".join(motivos_checkbox) if motivos_checkbox else motivo_obs
     motivo_cancelamento_completo = f"{texto_motivos}\n\nObservações: {motivo_obs}" if motivo_obs else texto_motivos
 
-    atualizar_status(
-        pedido_id=pedido_id,
-        status=StatusPedido.CANCELADO_MEDICO,
-        usuario_id=current_user.id,
-        descricao=f"Cancelado pelo médico regulador. Motivos: {texto_motivos}",
-        extra_campos={
-            "motivo_cancelamento": motivo_cancelamento_completo,
-            "motivos_devolucao_checkboxes": json.dumps(motivos_checkbox),
-        },
-    )
+    try:
+        atualizar_status(
+            pedido_id=pedido_id,
+            status=StatusPedido.CANCELADO_MEDICO,
+            usuario_id=current_user.id,
+            descricao=f"Cancelado pelo médico regulador. Motivos: {texto_motivos}",
+            extra_campos={
+                "motivo_cancelamento": motivo_cancelamento_completo,
+                "motivos_devolucao_checkboxes": json.dumps(motivos_checkbox),
+            },
+            versao=versao_do_form(),
+            reservado_para=_reservado_para(),
+        )
+    except pedidos_repo.ConflitoVersao as erro:
+        return _responder_conflito(erro, tipo_regulacao, filtros_ativos)
     
     flash("Pedido cancelado.", "info")
     
     # Redirecionar mantendo filtros e tipo
-    params = [f"tipo={tipo_regulacao}"]
-    for key, value in filtros_ativos.items():
-        if value:
-            params.append(f"{key}={value}")
-    
-    redirect_url = url_for("regulator.painel") + "?" + "&".join(params)
-    return redirect(redirect_url)
+    return _redirect_painel(tipo_regulacao, filtros_ativos)
 
 
 @regulator_bp.route("/pedidos/<int:pedido_id>/devolver", methods=["POST"])
@@ -211,51 +260,40 @@ def devolver(pedido_id: int):
     motivos_checkbox = request.form.getlist("motivos_checkbox")
     
     # Obter filtros ativos para manter na navegação após ação
-    filtros_ativos = {
-        'unidade': request.form.get('filtro_unidade', ''),
-        'categoria': request.form.get('filtro_categoria', ''),
-        'cpf': request.form.get('filtro_cpf', ''),
-        'nome': request.form.get('filtro_nome', '')
-    }
+    filtros_ativos = _filtros_do_form()
     
     if not motivos_checkbox and not motivo_obs:
         flash("Selecione pelo menos um motivo ou adicione observações.", "danger")
         # Redirecionar mantendo filtros
-        params = [f"tipo={tipo_regulacao}"]
-        for key, value in filtros_ativos.items():
-            if value:
-                params.append(f"{key}={value}")
-        redirect_url = url_for("regulator.painel") + "?" + "&".join(params)
-        return redirect(redirect_url)
+        return _redirect_painel(tipo_regulacao, filtros_ativos)
 
     # Preparar texto dos checkboxes para motivo_devolucao (compatibilidade)
     texto_motivos = ", ".join(motivos_checkbox) if motivos_checkbox else motivo_obs
     motivo_devolucao_completo = f"{texto_motivos}\n\nObservações: {motivo_obs}" if motivo_obs else texto_motivos
 
-    atualizar_status(
-        pedido_id=pedido_id,
-        status=StatusPedido.DEVOLVIDO_PELO_MEDICO,
-        usuario_id=current_user.id,
-        descricao=f"Pedido devolvido para a recepção. Motivos: {texto_motivos}",
-        extra_campos={
-            "pendente_recepcao": 1,
-            "motivo_devolucao": motivo_devolucao_completo,
-            "motivos_devolucao_checkboxes": json.dumps(motivos_checkbox),
-            "tipo_regulacao": None,
-            "prioridade": None,
-        },
-    )
+    try:
+        atualizar_status(
+            pedido_id=pedido_id,
+            status=StatusPedido.DEVOLVIDO_PELO_MEDICO,
+            usuario_id=current_user.id,
+            descricao=f"Pedido devolvido para a recepção. Motivos: {texto_motivos}",
+            extra_campos={
+                "pendente_recepcao": 1,
+                "motivo_devolucao": motivo_devolucao_completo,
+                "motivos_devolucao_checkboxes": json.dumps(motivos_checkbox),
+                "tipo_regulacao": None,
+                "prioridade": None,
+            },
+            versao=versao_do_form(),
+            reservado_para=_reservado_para(),
+        )
+    except pedidos_repo.ConflitoVersao as erro:
+        return _responder_conflito(erro, tipo_regulacao, filtros_ativos)
     
     flash("Pedido devolvido à recepção da unidade.", "warning")
     
     # Redirecionar mantendo filtros e tipo
-    params = [f"tipo={tipo_regulacao}"]
-    for key, value in filtros_ativos.items():
-        if value:
-            params.append(f"{key}={value}")
-    
-    redirect_url = url_for("regulator.painel") + "?" + "&".join(params)
-    return redirect(redirect_url)
+    return _redirect_painel(tipo_regulacao, filtros_ativos)
 
 
 @regulator_bp.route("/painel/limpar-filtros")
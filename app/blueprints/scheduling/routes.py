@@ -1,9 +1,11 @@
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, abort
+from flask import render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_login import login_required, current_user
 
 from app.repositories import pedidos as pedidos_repo
 from app.services.agendamento_service import registrar_tentativa
+from app.services.distribuicao_service import manter_lista_agendador, montar_lista_agendador
+from app.utils.conflitos import versao_do_form
 from app.utils.decorators import roles_required
 from . import scheduling_bp
 
@@ -30,33 +32,25 @@ def lista(tipo: str):
     exame_q = request.args.get("exame", type=str)
     cpf = request.args.get("cpf", type=str)
 
-    # Buscar todos os pedidos do tipo
+    # Agendador vê só a própria lista de trabalho (distribuída por carga e
+    # especialidade); o admin continua vendo a fila inteira
+    reservado_por = None
+    total_lista = None
+    if current_user.role != "admin":
+        total_lista = montar_lista_agendador(tipo, current_user)
+        reservado_por = current_user.id
+
+    # Buscar os pedidos do tipo (nome e CPF/Cartão SUS filtrados no SQL)
     pedidos = pedidos_repo.listar_para_agendador(
         tipo,
         ano=ano,
         mes=mes,
-        prioridade=prioridade
+        prioridade=prioridade,
+        nome=nome,
+        documento=cpf,
+        reservado_por=reservado_por,
     )
 
-    # Filtrar por nome/cpf se fornecidos
-    if nome or cpf:
-        pedidos_filtrados = []
-        nome_lower = nome.lower() if nome else None
-        cpf_digits = ''.join(filter(str.isdigit, cpf)) if cpf else None
-        for p in pedidos:
-            incluir = True
-            if nome_lower:
-                paciente_nome = (p.get('paciente_nome') or '').lower()
-                if nome_lower not in paciente_nome:
-                    incluir = False
-            if cpf_digits and incluir:
-                pedido_cpf = ''.join(filter(str.isdigit, (p.get('paciente_cpf') or '')))
-                if cpf_digits not in pedido_cpf:
-                    incluir = False
-            if incluir:
-                pedidos_filtrados.append(p)
-        pedidos = pedidos_filtrados
-
     # Filtrar por nome do exame se fornecido (filtro adicional)
     if exame_q:
         exame_lower = exame_q.lower()
@@ -141,9 +135,27 @@ def lista(tipo: str):
         nome_selecionado=nome,
         cpf_selecionado=cpf,
         tipo_agendador=current_user.tipo_agendador,
+        total_lista=total_lista,
     )
 
 
+# ==========================================================
+# 💓 Presença na fila (heartbeat da tela de agendamento)
+# ==========================================================
+@scheduling_bp.route("/<tipo>/presenca", methods=["POST"])
+@login_required
+def presenca(tipo: str):
+    """Mantém a lista de trabalho do agendador enquanto a página está aberta."""
+    if tipo not in ("municipal", "estadual"):
+        abort(404)
+
+    papel_necessario = "agendador_municipal" if tipo == "municipal" else "agendador_estadual"
+    if current_user.role != papel_necessario:
+        abort(403)
+
+    return jsonify({"status": "ok", "reservados": manter_lista_agendador(tipo, current_user)})
+
+
 # ==========================================================
 # 🧾 Registrar tentativa de agendamento
 # ==========================================================
@@ -192,8 +204,13 @@ def registrar(tipo: str, pedido_id: int):
             data_exame=data_exame_final,
             horario_exame=horario_final,
             local_exame=local_exame,
+            versao=versao_do_form(),
+            # A tentativa só vale para a lista de trabalho de quem a registra
+            reservado_para=None if current_user.role == "admin" else current_user.id,
         )
         flash("Tentativa registrada com sucesso.", "success")
+    except pedidos_repo.ConflitoVersao as exc:
+        flash(str(exc), "warning")
     except ValueError as exc:
         flash(str(exc), "danger")
 
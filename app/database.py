@@ -1,12 +1,24 @@
+import logging
+import time
 from contextlib import contextmanager
-from typing import Generator, Tuple
+from dataclasses import dataclass, field
+from typing import Callable, Generator, List, Optional, Tuple
 
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector import errorcode
 
+from flask import g, has_app_context, has_request_context, session
 from werkzeug.security import generate_password_hash
 
-from .schema import SCHEMA_STATEMENTS
+from .pool import (
+    ConexaoPool,
+    MonitorReplica,
+    PoolConexoes,
+    config_de_dsn,
+    montar_comandos_sessao,
+)
+from .schema import MIGRACOES, SCHEMA_VERSION_TABLE
+from .slowlog import RegistroConsultasLentas
 
 DEFAULT_ADMIN = {
     "nome": "Leandro da Silva",
@@ -15,48 +27,275 @@ DEFAULT_ADMIN = {
     "role": "admin",
 }
 
+logger = logging.getLogger(__name__)
+
+# Pools isolados por carga de trabalho
+POOL_PRINCIPAL = "principal"  # fluxo de regulação (recepção, malote, médico, agendamento)
+POOL_CHAT = "chat"  # chat, presença e heartbeats
+POOL_RELATORIOS = "relatorios"  # dashboards e agregações pesadas
+POOL_REPLICA = "replica"  # leituras (readonly=True) quando há réplica configurada
+
+# DDL repetido de uma migração interrompida antes de registrar a versão
+_ERROS_JA_APLICADO = (
+    errorcode.ER_TABLE_EXISTS_ERROR,
+    errorcode.ER_DUP_FIELDNAME,
+    errorcode.ER_DUP_KEYNAME,
+)
+
+_COMANDOS_ESCRITA = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "ALTER", "DROP", "TRUNCATE", "CALL")
+
+
+@dataclass
+class _Transacao:
+    """Conexão em uso no contexto atual (requisição, evento Socket.IO ou bloco externo)."""
+
+    conexao: mysql.connector.MySQLConnection
+    fixada: bool
+    profundidade: int = 0
+    falhou: bool = False
+    savepoints: int = 0
+    apos_commit: List[Callable[[], None]] = field(default_factory=list)
+
+
+class _CursorRastreado:
+    """
+    Envolve o cursor do mysql-connector para saber se a transação escreveu,
+    o que prende as leituras seguintes ao primário (read-your-writes), e para
+    medir o tempo de cada instrução quando o log de consultas lentas está ativo.
+    A medição vai do ``execute`` até a primeira leitura do resultado
+    (``fetchone``/``fetchmany``/``fetchall``/iteração) ou, sem leitura, até o
+    próximo ``execute``/``close``: o tempo que a aplicação gasta entre as
+    linhas não entra na conta.
+    """
+
+    def __init__(self, conector: "MySQLConnector", cursor):
+        self._conector = conector
+        self._cursor = cursor
+        self._medicao: Optional[tuple] = None
+
+    def __getattr__(self, nome: str):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        self._finalizar_medicao()
+        return iter(self._cursor)
+
+    def _verificar_escrita(self, operacao) -> None:
+        comando = operacao.lstrip()[:8].upper()
+        if comando.startswith(_COMANDOS_ESCRITA):
+            self._conector.registrar_escrita()
+
+    def _finalizar_medicao(self, linhas: Optional[int] = None) -> None:
+        if self._medicao is None:
+            return
+        operacao, params, inicio = self._medicao
+        self._medicao = None
+        if linhas is None:
+            linhas = self._cursor.rowcount
+        self._conector.slowlog.registrar(operacao, params, time.perf_counter() - inicio, linhas)
+
+    def execute(self, operacao, params=None, *args, **kwargs):
+        self._finalizar_medicao()
+        self._verificar_escrita(operacao)
+        if self._conector.slowlog is not None:
+            self._medicao = (operacao, params, time.perf_counter())
+        return self._cursor.execute(operacao, params, *args, **kwargs)
+
+    def executemany(self, operacao, seq_params, *args, **kwargs):
+        self._finalizar_medicao()
+        self._verificar_escrita(operacao)
+        return self._cursor.executemany(operacao, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        linha = self._cursor.fetchone()
+        self._finalizar_medicao()
+        return linha
+
+    def fetchmany(self, *args, **kwargs):
+        linhas = self._cursor.fetchmany(*args, **kwargs)
+        self._finalizar_medicao()
+        return linhas
+
+    def fetchall(self):
+        linhas = self._cursor.fetchall()
+        self._finalizar_medicao(len(linhas))
+        return linhas
+
+    def close(self):
+        self._finalizar_medicao()
+        return self._cursor.close()
+
 
 class MySQLConnector:
     def __init__(self):
-        self.pool: pooling.MySQLConnectionPool | None = None
+        self.pool: PoolConexoes | None = None
+        self.pools: dict[str, PoolConexoes] = {}
+        self.replica: MonitorReplica | None = None
+        self.slowlog: RegistroConsultasLentas | None = None
+        self.escopo_requisicao = False
+        self.janela_primario = 0.0
 
     def init_app(self, app):
+        # Os hooks valem por app (um segundo create_app() em testes/scripts
+        # também precisa do commit e da devolução das conexões); só os pools
+        # são do processo e ficam atrás da guarda abaixo
+        if "mysql" not in app.extensions:
+            app.extensions["mysql"] = self
+            if app.config.get("MYSQL_REQUEST_SCOPED", False):
+                app.after_request(self._confirmar_requisicao)
+            app.teardown_appcontext(self._finalizar_contexto)
+
         if self.pool is not None:
             return
 
-        self.pool = pooling.MySQLConnectionPool(
-            pool_name=app.config["MYSQL_POOL_NAME"],
-            pool_size=app.config["MYSQL_POOL_SIZE"],
-            pool_reset_session=app.config["MYSQL_POOL_RESET_SESSION"],
-            host=app.config["MYSQL_HOST"],
-            port=app.config["MYSQL_PORT"],
-            user=app.config["MYSQL_USER"],
-            password=app.config["MYSQL_PASSWORD"],
-            database=app.config["MYSQL_DATABASE"],
-            autocommit=False,
-            time_zone='-03:00',  # ✅ TIMEZONE BRASÍLIA
-            sql_mode='',  # ✅ OPCIONAL: desabilitar modo estrito se necessário
-        )
-
-        app.logger.info("Pool de conexões MySQL inicializado.")
-        self.ensure_schema(app.logger)
+        self.escopo_requisicao = app.config.get("MYSQL_REQUEST_SCOPED", False)
+        config_conexao = {
+            "host": app.config["MYSQL_HOST"],
+            "port": app.config["MYSQL_PORT"],
+            "user": app.config["MYSQL_USER"],
+            "password": app.config["MYSQL_PASSWORD"],
+            "database": app.config["MYSQL_DATABASE"],
+        }
+        # ✅ TIMEZONE BRASÍLIA, sql_mode etc. aplicados uma vez por conexão física
+        comandos_sessao = montar_comandos_sessao(app.config)
+
+        definicoes = {
+            POOL_PRINCIPAL: {
+                "size": app.config["MYSQL_POOL_SIZE"],
+                "timeout": app.config["MYSQL_POOL_TIMEOUT"],
+            }
+        }
+        definicoes.update(app.config.get("MYSQL_POOLS") or {})
+
+        for nome, definicao in definicoes.items():
+            if int(definicao.get("size") or 0) <= 0:
+                continue
+            self.pools[nome] = PoolConexoes(
+                nome=nome,
+                tamanho=int(definicao["size"]),
+                timeout=float(definicao.get("timeout", app.config["MYSQL_POOL_TIMEOUT"])),
+                max_espera=int(definicao.get("max_waiters", app.config["MYSQL_POOL_MAX_WAITERS"])),
+                resetar_sessao=app.config["MYSQL_POOL_RESET_SESSION"],
+                retry_after=app.config["MYSQL_POOL_RETRY_AFTER"],
+                intervalo_log=app.config["MYSQL_POOL_LOG_INTERVAL"],
+                config_conexao=config_conexao,
+                comandos_sessao=comandos_sessao,
+            )
+        self.pool = self.pools[POOL_PRINCIPAL]
+
+        dsn_replica = app.config.get("MYSQL_REPLICA_DSN")
+        if dsn_replica:
+            self.pools[POOL_REPLICA] = PoolConexoes(
+                nome=POOL_REPLICA,
+                tamanho=app.config["MYSQL_REPLICA_POOL_SIZE"],
+                timeout=app.config["MYSQL_POOL_TIMEOUT"],
+                max_espera=app.config["MYSQL_POOL_MAX_WAITERS"],
+                resetar_sessao=app.config["MYSQL_POOL_RESET_SESSION"],
+                retry_after=app.config["MYSQL_POOL_RETRY_AFTER"],
+                intervalo_log=app.config["MYSQL_POOL_LOG_INTERVAL"],
+                config_conexao=config_de_dsn(dsn_replica, config_conexao),
+                comandos_sessao=comandos_sessao,
+            )
+            self.replica = MonitorReplica(
+                self.pools[POOL_REPLICA],
+                max_atraso=app.config["MYSQL_REPLICA_MAX_LAG"],
+                intervalo=app.config["MYSQL_REPLICA_LAG_CHECK_INTERVAL"],
+            )
+            self.janela_primario = app.config["MYSQL_REPLICA_STICKY_SECONDS"]
+
+        if app.config.get("MYSQL_SLOW_QUERY_MS", 0) > 0:
+            self.slowlog = RegistroConsultasLentas(
+                limite_ms=app.config["MYSQL_SLOW_QUERY_MS"],
+                capacidade=app.config["MYSQL_SLOW_QUERY_BUFFER"],
+                capacidade_explains=app.config.get("MYSQL_SLOW_QUERY_EXPLAINS", 300),
+                # EXPLAIN sai do pool de relatórios para não competir com o fluxo clínico
+                obter_conexao=lambda: self.get_connection(POOL_RELATORIOS),
+            )
+
+        app.logger.info("Pools de conexões MySQL inicializados: %s.", ", ".join(self.pools))
+        if app.config.get("MYSQL_SCHEMA_CHECK", True):
+            self.ensure_schema(app.logger)
+
+    @staticmethod
+    def _versao_schema(cursor) -> int:
+        try:
+            cursor.execute("SELECT MAX(versao) FROM schema_version")
+        except mysql.connector.errors.ProgrammingError:
+            # Banco ainda sem controle de versão
+            return 0
+        (versao,) = cursor.fetchone()
+        return versao or 0
 
     def ensure_schema(self, logger=None):
+        """
+        Aplica as migrações pendentes de ``app.schema.MIGRACOES``.
+        Com o schema em dia, custa uma única leitura indexada em schema_version.
+        """
         if not self.pool:
             raise RuntimeError("Pool de conexões não inicializado.")
 
-        with self.get_cursor(dictionary=False) as (connection, cursor):
-            # ✅ DEFINIR TIMEZONE LOGO APÓS CONECTAR
-            cursor.execute("SET time_zone = '-03:00'")
-            
-            for statement in SCHEMA_STATEMENTS:
-                cursor.execute(statement)
+        with self.get_cursor(dictionary=False) as (_, cursor):
+            versao = self._versao_schema(cursor)
+
+        versao_alvo = MIGRACOES[-1].versao
+        if versao >= versao_alvo:
+            if logger:
+                logger.info("Schema do banco na versão %s.", versao)
+            return
+
+        with self.get_cursor(dictionary=False) as (conexao, cursor):
+            # Vários processos podem subir ao mesmo tempo: só um migra.
+            cursor.execute("SELECT GET_LOCK('central_regulacao_schema', 60)")
+            (obtido,) = cursor.fetchone()
+            if obtido != 1:
+                # 0 = outro processo segurou o lock além do prazo; NULL = erro
+                raise RuntimeError(
+                    "Não foi possível obter o lock de migração do schema "
+                    f"(GET_LOCK retornou {obtido!r}); outro processo pode estar migrando."
+                )
+            try:
+                cursor.execute(SCHEMA_VERSION_TABLE)
+                versao = self._versao_schema(cursor)
+                for migracao in MIGRACOES:
+                    if migracao.versao <= versao:
+                        continue
+                    for comando in migracao.comandos:
+                        self._executar_migracao(cursor, comando, logger)
+                    if migracao.dados:
+                        migracao.dados(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (versao, descricao) VALUES (%s, %s)",
+                        (migracao.versao, migracao.descricao),
+                    )
+                    # DDL faz commit implícito; o registro da versão precisa do explícito.
+                    conexao.commit()
+                    if logger:
+                        logger.info("Migração %s aplicada: %s.", migracao.versao, migracao.descricao)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('central_regulacao_schema')")
+                cursor.fetchone()
 
         if logger:
-            logger.info("Schema do banco verificado/criado com sucesso.")
+            logger.info("Schema do banco atualizado para a versão %s.", versao_alvo)
 
         self.ensure_default_admin(logger)
 
+    @staticmethod
+    def _executar_migracao(cursor, comando: str, logger=None) -> None:
+        """
+        Executa um passo de migração tolerando o que já foi aplicado. O DDL faz
+        commit implícito: se o processo cair entre ele e o INSERT em
+        schema_version, a próxima subida repete a migração e encontra a
+        coluna/índice/tabela já criados.
+        """
+        try:
+            cursor.execute(comando)
+        except mysql.connector.Error as exc:
+            if exc.errno not in _ERROS_JA_APLICADO:
+                raise
+            if logger:
+                logger.warning("Passo de migração já aplicado, ignorado: %s", exc.msg)
+
     def ensure_default_admin(self, logger=None):
         if not self.pool:
             raise RuntimeError("Pool de conexões não inicializado.")
@@ -98,30 +337,257 @@ class MySQLConnector:
         if logger:
             logger.info("Usuário administrador padrão criado com sucesso.")
 
-    def get_connection(self) -> mysql.connector.MySQLConnection:
+    def _resolver_pool(self, pool: Optional[str]) -> str:
+        """
+        Pool explícito > pool padrão do contexto (blueprint/``usar_pool``) > principal.
+        Pools não configurados compartilham o pool principal.
+        """
+        if pool is None and has_app_context():
+            pool = g.get("_mysql_pool_padrao")
+        return pool if pool in self.pools else POOL_PRINCIPAL
+
+    def get_connection(self, pool: Optional[str] = None) -> ConexaoPool:
+        if not self.pool:
+            raise RuntimeError("Pool de conexões não inicializado.")
+        # A sessão (timezone, sql_mode...) já foi inicializada quando a conexão física foi aberta.
+        return self.pools[self._resolver_pool(pool)].obter()
+
+    @contextmanager
+    def usar_pool(self, nome: str):
+        """
+        Define o pool padrão do contexto atual. Pode ser usado como
+        ``with mysql.usar_pool(POOL_CHAT):`` ou como decorator de handlers.
+        """
+        anterior = g.get("_mysql_pool_padrao")
+        g._mysql_pool_padrao = nome
+        try:
+            yield
+        finally:
+            g._mysql_pool_padrao = anterior
+
+    def registrar_pool_blueprint(self, blueprint, nome: str) -> None:
+        """Todas as rotas do blueprint passam a usar o pool ``nome`` por padrão."""
+
+        @blueprint.before_request
+        def _definir_pool_padrao():
+            g._mysql_pool_padrao = nome
+
+    def estatisticas(self) -> dict:
         if not self.pool:
             raise RuntimeError("Pool de conexões não inicializado.")
-        connection = self.pool.get_connection()
-        # ✅ DEFINIR TIMEZONE EM CADA CONEXÃO
-        cursor = connection.cursor()
-        cursor.execute("SET time_zone = '-03:00'")
-        cursor.close()
-        return connection
+        dados = {"pools": {nome: pool.estatisticas() for nome, pool in self.pools.items()}}
+        if self.replica is not None:
+            dados["replica"] = self.replica.estatisticas()
+        return dados
+
+    def registrar_escrita(self) -> None:
+        """
+        Marca que o contexto atual escreveu no primário: o restante da
+        requisição e as próximas requisições da sessão (por
+        MYSQL_REPLICA_STICKY_SECONDS) leem do primário.
+        """
+        if self.replica is None or not has_app_context():
+            return
+        g._mysql_escreveu = True
+        if has_request_context() and self.janela_primario > 0:
+            session["_mysql_primario_ate"] = time.time() + self.janela_primario
+
+    def _rotear_leitura(self, pool: str) -> str:
+        if self.replica is None:
+            return pool
+        if has_app_context():
+            if g.get("_mysql_escreveu"):
+                return pool
+            if has_request_context() and session.get("_mysql_primario_ate", 0) > time.time():
+                return pool
+        if not self.replica.disponivel():
+            return pool
+        return POOL_REPLICA
+
+    def _transacao_atual(self, pool: str) -> Optional[_Transacao]:
+        if not has_app_context():
+            return None
+        return g.get("_mysql_transacoes", {}).get(pool)
+
+    def apos_commit(self, callback: Callable[[], None], pool: Optional[str] = None) -> None:
+        """
+        Executa ``callback`` depois do commit da transação aberta no contexto
+        (descartado se ela sofrer rollback). Sem transação aberta, executa já.
+        Usado para efeitos fora do banco (invalidação de cache) que não podem
+        acontecer antes de a escrita ficar visível.
+        """
+        transacao = self._transacao_atual(self._resolver_pool(pool))
+        if transacao is None:
+            callback()
+        else:
+            transacao.apos_commit.append(callback)
+
+    @staticmethod
+    def _executar(conexao, comando: str) -> None:
+        cursor = conexao.cursor()
+        try:
+            cursor.execute(comando)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _encerrar(transacao: _Transacao, sucesso: bool) -> None:
+        conexao = transacao.conexao
+        confirmada = False
+        try:
+            if sucesso and not transacao.falhou:
+                conexao.commit()
+                confirmada = True
+            else:
+                conexao.rollback()
+        finally:
+            conexao.close()
+        if sucesso and transacao.falhou:
+            # Um bloco interno falhou sem poder ser desfeito isoladamente: quem
+            # abriu a transação não pode "terminar bem" sem as próprias escritas
+            raise RuntimeError("Transação desfeita: um bloco interno falhou e não pôde ser revertido.")
+        if not confirmada:
+            return
+        for callback in transacao.apos_commit:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Falha em callback pós-commit.")
+
+    def _confirmar_requisicao(self, resposta):
+        """
+        after_request (modo MYSQL_REQUEST_SCOPED): commit da transação fixada
+        antes de a resposta sair. Se o commit falhar, a exceção sobe e o
+        cliente recebe 500 — não um 200/redirect com flash de sucesso de uma
+        escrita perdida (a sessão com o flash nem chega a ser salva).
+        """
+        transacoes = g.pop("_mysql_transacoes", None) or {}
+        erro: Optional[Exception] = None
+        for nome, transacao in transacoes.items():
+            try:
+                self._encerrar(transacao, sucesso=True)
+            except Exception as exc:
+                logger.exception("Falha no commit da transação da requisição (pool %s).", nome)
+                erro = erro or exc
+        if erro is not None:
+            raise erro
+        return resposta
+
+    def _finalizar_contexto(self, exc: Optional[BaseException]) -> None:
+        """
+        Teardown do app context: encerra o que ainda estiver fixado — requisição
+        que terminou em exceção (rollback), eventos Socket.IO e o trecho
+        transmitido de respostas em streaming — e devolve as conexões ao pool.
+        Aqui a resposta já foi enviada, então uma falha só pode ser registrada.
+        """
+        transacoes = g.pop("_mysql_transacoes", None) or {}
+        for nome, transacao in transacoes.items():
+            try:
+                self._encerrar(transacao, sucesso=exc is None)
+            except Exception:
+                logger.exception("Falha ao finalizar a transação da requisição (pool %s).", nome)
 
     @contextmanager
     def get_cursor(
-        self, *, dictionary: bool = True
+        self,
+        *,
+        dictionary: bool = True,
+        pool: Optional[str] = None,
+        readonly: bool = False,
+        savepoint: bool = False,
     ) -> Generator[
         Tuple[mysql.connector.MySQLConnection, mysql.connector.cursor.MySQLCursor], None, None
     ]:
-        connection = self.get_connection()
-        cursor = connection.cursor(dictionary=dictionary)
+        """
+        Fornece (conexão, cursor) dentro de uma transação.
+
+        Chamadas aninhadas reaproveitam a transação já aberta no contexto atual
+        em vez de retirar outra conexão do pool. Com MYSQL_REQUEST_SCOPED ativo,
+        a primeira chamada da requisição fixa a conexão em ``flask.g`` e o
+        commit acontece uma única vez, no after_request (rollback no teardown
+        se a requisição falhar). Cada pool nomeado
+        tem sua própria transação no contexto.
+
+        Uma exceção num bloco aninhado condena a transação inteira (o commit
+        de quem a abriu levanta erro), a menos que o bloco peça
+        ``savepoint=True``: aí ele roda sob SAVEPOINT e a exceção desfaz só
+        esse bloco. É para escritas cuja falha quem chamou trata (conflito de
+        versão); custa duas idas ao banco a mais (SAVEPOINT e RELEASE), e só
+        quando o bloco de fato não é o dono da transação.
+
+        ``readonly=True`` envia a leitura para a réplica (se configurada e em
+        dia), exceto quando o contexto/sessão já escreveu no primário.
+        """
+        pool = pool_base = self._resolver_pool(pool)
+        if readonly:
+            pool = self._rotear_leitura(pool_base)
+        transacao = self._transacao_atual(pool)
+        if transacao is None:
+            try:
+                conexao = self.get_connection(pool)
+            except mysql.connector.Error:
+                if pool != POOL_REPLICA:
+                    raise
+                logger.warning("Réplica indisponível; leitura desviada para o primário.", exc_info=True)
+                self.replica.marcar_falha()
+                pool = pool_base
+                transacao = self._transacao_atual(pool)
+                conexao = None if transacao else self.get_connection(pool)
+
+        if transacao is None:
+            if not has_app_context():
+                cursor = _CursorRastreado(self, conexao.cursor(dictionary=dictionary))
+                try:
+                    yield conexao, cursor
+                    conexao.commit()
+                except Exception:
+                    conexao.rollback()
+                    raise
+                finally:
+                    cursor.close()
+                    conexao.close()
+                return
+
+            transacao = _Transacao(conexao=conexao, fixada=self.escopo_requisicao)
+            g.setdefault("_mysql_transacoes", {})[pool] = transacao
+            dona = not transacao.fixada
+        else:
+            dona = False
+
+        # Bloco que não encerra a transação (aninhado ou dentro da requisição
+        # fixada) e pediu SAVEPOINT: uma exceção tratada por quem chamou
+        # desfaz só este bloco em vez de condenar a transação inteira
+        nome_savepoint = None
+        if savepoint and not dona:
+            transacao.savepoints += 1
+            nome_savepoint = f"sp_{transacao.savepoints}"
+            self._executar(transacao.conexao, f"SAVEPOINT {nome_savepoint}")
+            callbacks_antes = len(transacao.apos_commit)
+
+        cursor = _CursorRastreado(self, transacao.conexao.cursor(dictionary=dictionary))
+        transacao.profundidade += 1
+        sucesso = False
         try:
-            yield connection, cursor
-            connection.commit()
+            yield transacao.conexao, cursor
+            if nome_savepoint is not None:
+                # Sem RELEASE, os savepoints se acumulariam na conexão até o commit
+                self._executar(transacao.conexao, f"RELEASE SAVEPOINT {nome_savepoint}")
+            sucesso = True
         except Exception:
-            connection.rollback()
+            if nome_savepoint is None:
+                transacao.falhou = True
+            else:
+                try:
+                    self._executar(transacao.conexao, f"ROLLBACK TO SAVEPOINT {nome_savepoint}")
+                    del transacao.apos_commit[callbacks_antes:]
+                except mysql.connector.Error:
+                    # Savepoint perdido (DDL/commit implícito, conexão caída)
+                    logger.warning("Falha ao reverter o savepoint %s.", nome_savepoint, exc_info=True)
+                    transacao.falhou = True
             raise
         finally:
             cursor.close()
-            connection.close()
\ No newline at end of file
+            transacao.profundidade -= 1
+            if transacao.profundidade == 0 and not transacao.fixada:
+                g._mysql_transacoes.pop(pool, None)
+                self._encerrar(transacao, sucesso)
@@ -1,6 +1,8 @@
+from flask import has_request_context, request
 from flask_socketio import SocketIO
 from flask_login import LoginManager
-from .database import MySQLConnector
+from .acompanhamento import ProtecaoAcompanhamento
+from .database import POOL_CHAT, MySQLConnector
 from .models.usuario import Usuario
 
 # Usa gevent em vez de eventlet
@@ -13,9 +15,11 @@ socketio = SocketIO(
 
 mysql = MySQLConnector()
 login_manager = LoginManager()
+acompanhamento = ProtecaoAcompanhamento()
 
 def init_extensions(app):
     mysql.init_app(app)
+    acompanhamento.init_app(app)
     login_manager.init_app(app)
     socketio.init_app(app)
     login_manager.login_view = "auth.login"
@@ -24,7 +28,12 @@ def init_extensions(app):
 @login_manager.user_loader
 def load_user(user_id: str):
     from app.repositories import usuarios as usuarios_repo
-    data = usuarios_repo.obter_por_id(int(user_id))
+    # Eventos Socket.IO não têm blueprint: o usuário é carregado pelo pool do
+    # chat, senão cada evento disputaria o pool principal com a regulação
+    pool = None
+    if has_request_context() and request.blueprint is None:
+        pool = POOL_CHAT
+    data = usuarios_repo.obter_por_id(int(user_id), pool=pool)
     if data:
         return Usuario.from_row(data)
     return None
\ No newline at end of file
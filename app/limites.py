@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Tuple
+
+
+class LimitadorTaxa:
+    """
+    Token bucket por chave (ex.: IP do cliente). Cada chave acumula até
+    ``capacidade`` fichas, repostas a ``taxa`` fichas por segundo; a reposição
+    é calculada na hora do consumo, sem thread de fundo. Guarda no máximo
+    ``max_chaves`` baldes, descartando os usados há mais tempo.
+    """
+
+    def __init__(self, capacidade: float, taxa: float, max_chaves: int = 10000):
+        self.capacidade = float(capacidade)
+        self.taxa = float(taxa)
+        self.max_chaves = max_chaves
+        self._lock = threading.Lock()
+        self._baldes: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.permitidas = 0
+        self.recusadas = 0
+
+    def consumir(self, chave: Hashable) -> Tuple[bool, int]:
+        """Retorna (permitido, segundos até haver uma ficha)."""
+        agora = time.monotonic()
+        with self._lock:
+            balde = self._baldes.pop(chave, None)
+            if balde is None:
+                balde = [self.capacidade, agora]
+            else:
+                fichas, ultimo = balde
+                balde[0] = min(self.capacidade, fichas + (agora - ultimo) * self.taxa)
+                balde[1] = agora
+            self._baldes[chave] = balde
+            if len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+
+            if balde[0] >= 1.0:
+                balde[0] -= 1.0
+                self.permitidas += 1
+                return True, 0
+            self.recusadas += 1
+            faltam = (1.0 - balde[0]) / self.taxa if self.taxa > 0 else 60.0
+            return False, max(1, int(faltam + 0.999))
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "capacidade": self.capacidade,
+                "taxa_por_segundo": self.taxa,
+                "chaves": len(self._baldes),
+                "permitidas": self.permitidas,
+                "recusadas": self.recusadas,
+            }
+
+
+class CacheTTL:
+    """
+    Cache em memória com expiração por entrada e invalidação por etiqueta:
+    cada valor pode ser guardado com etiquetas (ex.: ``("pedido", 42)``) e
+    ``invalidar_etiqueta`` remove todas as entradas que a carregam.
+    """
+
+    def __init__(self, ttl: float, max_entradas: int = 1000):
+        self.ttl = float(ttl)
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._por_etiqueta: dict[Hashable, set] = {}
+        self.acertos = 0
+        self.faltas = 0
+        self.invalidacoes = 0
+
+    def obter(self, chave: Hashable, padrao: Any = None) -> Any:
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] <= agora:
+                if entrada is not None:
+                    self._remover(chave)
+                self.faltas += 1
+                return padrao
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada[1]
+
+    def guardar(self, chave: Hashable, valor: Any, etiquetas: Iterable[Hashable] = ()) -> None:
+        etiquetas = tuple(etiquetas)
+        with self._lock:
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (time.monotonic() + self.ttl, valor, etiquetas)
+            for etiqueta in etiquetas:
+                self._por_etiqueta.setdefault(etiqueta, set()).add(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._remover(next(iter(self._entradas)))
+
+    def invalidar(self, chave: Hashable) -> bool:
+        with self._lock:
+            if chave not in self._entradas:
+                return False
+            self._remover(chave)
+            self.invalidacoes += 1
+            return True
+
+    def invalidar_etiqueta(self, etiqueta: Hashable) -> int:
+        with self._lock:
+            chaves = self._por_etiqueta.pop(etiqueta, ())
+            for chave in list(chaves):
+                self._remover(chave)
+            self.invalidacoes += len(chaves)
+            return len(chaves)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._por_etiqueta.clear()
+
+    def _remover(self, chave: Hashable) -> None:
+        _, _, etiquetas = self._entradas.pop(chave)
+        for etiqueta in etiquetas:
+            chaves = self._por_etiqueta.get(etiqueta)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_etiqueta[etiqueta]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                "ttl_segundos": self.ttl,
+                "entradas": len(self._entradas),
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "taxa_acerto": round(self.acertos / consultas, 3) if consultas else None,
+                "invalidacoes": self.invalidacoes,
+            }
@@ -1,6 +1,7 @@
 # app/repositories/chat.py
 import os
 import logging
+from app.database import POOL_CHAT
 from app.extensions import mysql
 
 logger = logging.getLogger(__name__)
@@ -8,7 +9,7 @@ logger = logging.getLogger(__name__)
 def criar_tabelas():
     # usa o pool definido em app.database.MySQLConnector
         logger.debug("criar_tabelas: iniciando criação/verificação de tabelas")
-        with mysql.get_cursor(dictionary=False) as (conn, cur):
+        with mysql.get_cursor(dictionary=False, pool=POOL_CHAT) as (conn, cur):
                 cur.execute("""
                 CREATE TABLE IF NOT EXISTS conversations (
                     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -46,7 +47,7 @@ def criar_tabelas():
 
 def inserir_mensagem(conversation_id, sender_id, sender_name, text):
     logger.debug("inserir_mensagem: conv=%s sender=%s sender_name=%s text_len=%s", conversation_id, sender_id, sender_name, len(text or ""))
-    with mysql.get_cursor(dictionary=False) as (conn, cur):
+    with mysql.get_cursor(dictionary=False, pool=POOL_CHAT) as (conn, cur):
         cur.execute(
             "INSERT INTO messages (conversation_id, sender_id, sender_name, text) VALUES (%s, %s, %s, %s)",
             (conversation_id, sender_id, sender_name, text),
@@ -58,7 +59,7 @@ def inserir_mensagem(conversation_id, sender_id, sender_name, text):
 def inserir_anexos(message_id, attachments):
     """attachments: lista de dicts com original_filename, stored_filename, mime_type, size"""
     logger.debug("inserir_anexos: message_id=%s attachments_count=%s", message_id, len(attachments or []))
-    with mysql.get_cursor(dictionary=False) as (conn, cur):
+    with mysql.get_cursor(dictionary=False, pool=POOL_CHAT) as (conn, cur):
         for a in attachments:
             cur.execute(
                 """
@@ -72,7 +73,7 @@ def inserir_anexos(message_id, attachments):
 
 def listar_mensagens(conversation_id, limit=100):
     logger.debug("listar_mensagens: conv=%s limit=%s", conversation_id, limit)
-    with mysql.get_cursor(dictionary=True) as (conn, cur):
+    with mysql.get_cursor(dictionary=True, pool=POOL_CHAT) as (conn, cur):
         cur.execute(
             """
             SELECT m.id, m.conversation_id, m.sender_id, m.sender_name, m.text, m.created_at
@@ -1,6 +1,7 @@
 from typing import Optional
 
-from app.extensions import mysql
+from app.extensions import acompanhamento, mysql
+from app.utils.texto import escapar_like, normalizar_nome, somente_digitos
 
 
 def obter_por_id(paciente_id: int) -> Optional[dict]:
@@ -11,7 +12,7 @@ def obter_por_id(paciente_id: int) -> Optional[dict]:
 
 
 def obter_por_cpf(cpf: str) -> Optional[dict]:
-    cpf_sanitized = "".join(filter(str.isdigit, cpf or ""))
+    cpf_sanitized = somente_digitos(cpf)
     query = "SELECT * FROM pacientes WHERE cpf = %s"
     with mysql.get_cursor() as (_, cursor):
         cursor.execute(query, (cpf_sanitized,))
@@ -21,49 +22,109 @@ def obter_por_cpf(cpf: str) -> Optional[dict]:
 def criar_paciente(dados: dict) -> int:
     query = """
         INSERT INTO pacientes
-        (nome, cpf, data_nascimento, telefone_principal, telefone_secundario,
-         email, cartao_sus, endereco, unidade_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        (nome, nome_busca, cpf, data_nascimento, telefone_principal, telefone_secundario,
+         email, cartao_sus, cartao_sus_busca, endereco, unidade_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
     valores = (
         dados["nome"],
-        "".join(filter(str.isdigit, dados["cpf"])),
+        normalizar_nome(dados["nome"]),
+        somente_digitos(dados["cpf"]),
         dados.get("data_nascimento"),
         dados.get("telefone_principal"),
         dados.get("telefone_secundario"),
         dados.get("email"),
         dados.get("cartao_sus"),
+        somente_digitos(dados.get("cartao_sus")) or None,
         dados.get("endereco"),
         dados.get("unidade_id"),
     )
     with mysql.get_cursor() as (_, cursor):
         cursor.execute(query, valores)
-        return cursor.lastrowid
+        paciente_id = cursor.lastrowid
+    acompanhamento.registrar_cpf(valores[2])
+    return paciente_id
 
 
 def atualizar_paciente(paciente_id: int, dados: dict):
     query = """
         UPDATE pacientes
         SET nome=%s,
+            nome_busca=%s,
             data_nascimento=%s,
             telefone_principal=%s,
             telefone_secundario=%s,
             email=%s,
             cartao_sus=%s,
+            cartao_sus_busca=%s,
             endereco=%s,
             unidade_id=%s
         WHERE id=%s
     """
     valores = (
         dados["nome"],
+        normalizar_nome(dados["nome"]),
         dados.get("data_nascimento"),
         dados.get("telefone_principal"),
         dados.get("telefone_secundario"),
         dados.get("email"),
         dados.get("cartao_sus"),
+        somente_digitos(dados.get("cartao_sus")) or None,
         dados.get("endereco"),
         dados.get("unidade_id"),
         paciente_id,
     )
     with mysql.get_cursor() as (_, cursor):
-        cursor.execute(query, valores)
\ No newline at end of file
+        cursor.execute(query, valores)
+
+
+def contar() -> int:
+    with mysql.get_cursor(dictionary=False, readonly=True) as (_, cursor):
+        cursor.execute("SELECT COUNT(*) FROM pacientes")
+        return cursor.fetchone()[0]
+
+
+def listar_cpfs_desde(ultimo_id: int, limite: int = 10000) -> list[tuple[int, str]]:
+    """Lote de (id, cpf) com id > ``ultimo_id``, em ordem de id (percorre a PK)."""
+    query = "SELECT id, cpf FROM pacientes WHERE id > %s ORDER BY id LIMIT %s"
+    with mysql.get_cursor(dictionary=False) as (_, cursor):
+        cursor.execute(query, (ultimo_id, limite))
+        return cursor.fetchall()
+
+
+def buscar_por_documento(documento: str, limite: int = 20) -> list[dict]:
+    """
+    Pacientes por CPF ou Cartão SUS, só com dígitos: documento completo casa
+    por igualdade, parcial por prefixo. Ambos pelos índices das colunas.
+    """
+    condicao, params = condicao_documento(documento, alias="")
+    if not condicao:
+        return []
+    query = f"""
+        SELECT id, nome, cpf, cartao_sus, data_nascimento
+        FROM pacientes
+        WHERE {condicao}
+        ORDER BY nome
+        LIMIT %s
+    """
+    with mysql.get_cursor(readonly=True) as (_, cursor):
+        cursor.execute(query, (*params, limite))
+        return cursor.fetchall()
+
+
+def condicao_documento(documento: Optional[str], alias: str = "pa") -> tuple[Optional[str], list]:
+    """
+    Predicado SQL (e parâmetros) da busca por CPF/Cartão SUS sobre a tabela
+    pacientes com o ``alias`` dado. 11 dígitos: CPF exato; 15: Cartão SUS
+    exato; menos que isso: prefixo em qualquer um dos dois.
+    """
+    digitos = somente_digitos(documento)
+    if not digitos:
+        return None, []
+    prefixo = f"{alias}." if alias else ""
+    if len(digitos) == 11:
+        return f"{prefixo}cpf = %s", [digitos]
+    if len(digitos) >= 15:
+        return f"{prefixo}cartao_sus_busca = %s", [digitos]
+    padrao = escapar_like(digitos) + "%"
+    return f"({prefixo}cpf LIKE %s OR {prefixo}cartao_sus_busca LIKE %s)", [padrao, padrao]
@@ -1,6 +1,10 @@
-from typing import List, Optional
+from datetime import date, timedelta
+from typing import List, Optional, Sequence, Tuple
 from app.domain.status import StatusPedido
 from app.extensions import mysql
+from app.repositories.pacientes import condicao_documento
+from app.utils.paginacao import Pagina, decodificar_cursor, montar_pagina
+from app.utils.texto import escapar_like, normalizar_nome
 
 
 # ==========================================================
@@ -35,13 +39,74 @@ def criar_pedido(dados: dict) -> int:
 # ==========================================================
 # 🛠 Atualizar campos
 # ==========================================================
-def atualizar_campos(pedido_id: int, campos: dict):
+class ConflitoVersao(Exception):
+    """O pedido foi alterado (ou removido) depois que a tela o exibiu."""
+
+    def __init__(self, pedido_id: int):
+        super().__init__(
+            f"O pedido #{pedido_id} foi alterado por outro usuário. Confira os dados atualizados."
+        )
+        self.pedido_id = pedido_id
+
+
+class PedidoReservado(ConflitoVersao):
+    """O pedido está reservado (dentro do prazo) para outro usuário."""
+
+    def __init__(self, pedido_id: int, mensagem: Optional[str] = None):
+        Exception.__init__(
+            self, mensagem or f"O pedido #{pedido_id} está sendo tratado por outro usuário."
+        )
+        self.pedido_id = pedido_id
+
+
+def atualizar_campos(
+    pedido_id: int,
+    campos: dict,
+    cursor=None,
+    versao: Optional[int] = None,
+    reservado_para: Optional[int] = None,
+):
+    """
+    Com ``cursor``, o UPDATE entra na transação de quem chamou. Com
+    ``versao``, o UPDATE é condicional (``AND versao = %s``) e levanta
+    ``ConflitoVersao`` se não casar nenhuma linha — sem SELECT prévio.
+    Com ``reservado_para``, também não casa se o pedido estiver reservado
+    (dentro do prazo) para outro usuário, e levanta ``PedidoReservado``.
+    """
     set_clause = ", ".join([f"{coluna}=%s" for coluna in campos.keys()])
     valores = list(campos.values())
     valores.append(pedido_id)
-    query = f"UPDATE pedidos SET {set_clause}, data_atualizacao=NOW() WHERE id=%s"
-    with mysql.get_cursor() as (_, cursor):
-        cursor.execute(query, tuple(valores))
+    query = f"UPDATE pedidos SET {set_clause}, versao=versao+1, data_atualizacao=NOW() WHERE id=%s"
+    if versao is not None:
+        query += " AND versao=%s"
+        valores.append(versao)
+    if reservado_para is not None:
+        query += " AND (reservado_ate IS NULL OR reservado_ate <= NOW() OR reservado_por = %s)"
+        valores.append(reservado_para)
+
+    if cursor is None:
+        with mysql.get_cursor(savepoint=versao is not None or reservado_para is not None) as (_, cursor):
+            atualizar_campos(pedido_id, campos, cursor=cursor, versao=versao, reservado_para=reservado_para)
+        return
+    cursor.execute(query, tuple(valores))
+    # versao sempre muda, então linhas afetadas == linhas que casaram
+    if cursor.rowcount == 0 and (versao is not None or reservado_para is not None):
+        raise _motivo_conflito(cursor, pedido_id, reservado_para)
+
+
+def _motivo_conflito(cursor, pedido_id: int, reservado_para: Optional[int]) -> ConflitoVersao:
+    """Só no caminho de falha: diz se o UPDATE não casou por reserva ou por versão."""
+    if reservado_para is not None:
+        cursor.execute(
+            "SELECT reservado_por, reservado_ate > NOW() AS ativa FROM pedidos WHERE id = %s",
+            (pedido_id,),
+        )
+        linha = cursor.fetchone()
+        if linha is not None:
+            reservado_por, ativa = (linha["reservado_por"], linha["ativa"]) if isinstance(linha, dict) else linha
+            if ativa and reservado_por != reservado_para:
+                return PedidoReservado(pedido_id)
+    return ConflitoVersao(pedido_id)
 
 
 # ==========================================================
@@ -73,46 +138,296 @@ def obter_por_id(pedido_id: int) -> Optional[dict]:
         return cursor.fetchone()
 
 
-# ==========================================================
-# 📋 Listar por unidade
-# ==========================================================
-def listar_por_unidade(unidade_id: int) -> List[dict]:
+def obter_linha_fila(pedido_id: int) -> Optional[dict]:
+    """
+    Uma linha das filas do malote/regulador (mesmas colunas das listagens),
+    para redesenhar só o pedido afetado após um conflito de versão. Lê do
+    primário: a réplica ainda pode não ter a alteração que causou o conflito.
+    """
     query = """
         SELECT p.id,
                p.status,
-               p.tipo_regulacao,
                p.prioridade,
+               p.tipo_regulacao,
                p.tipo_solicitacao,
+               p.motivo_devolucao,
                p.data_solicitacao,
-               p.pendente_recepcao,
+               p.versao,
+               p.reservado_ate,
+               un.nome AS unidade_nome,
                pa.nome AS paciente_nome,
                pa.cpf AS paciente_cpf,
+               pa.telefone_principal,
                COALESCE(e.nome, c.especialidade) AS nome_solicitacao
         FROM pedidos p
         JOIN pacientes pa ON pa.id = p.paciente_id
         LEFT JOIN exames e ON e.id = p.exame_id
         LEFT JOIN consultas c ON c.id = p.consulta_id
-        WHERE p.unidade_id = %s
-        ORDER BY p.data_atualizacao DESC
+        JOIN unidades_saude un ON un.id = p.unidade_id
+        WHERE p.id = %s
     """
     with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(query, (unidade_id,))
-        return cursor.fetchall()
+        cursor.execute(query, (pedido_id,))
+        return cursor.fetchone()
 
 
 # ==========================================================
-# 📋 Listar pedidos devolvidos por unidade
+# 🖨 Folha de impressão (agregado completo)
 # ==========================================================
-def listar_devolvidos_por_unidade(unidade_id: int) -> List[dict]:
-    query = """
+_COLUNAS_FOLHA = {
+    "paciente": ("id", "nome", "cpf", "data_nascimento", "telefone_principal",
+                 "telefone_secundario", "email", "cartao_sus", "endereco", "unidade_id"),
+    "exame": ("id", "nome"),
+    "consulta": ("id", "nome", "especialidade", "descricao"),
+    "unidade": ("id", "nome", "codigo", "telefone", "endereco"),
+}
+_ALIAS_FOLHA = {"paciente": "pa", "exame": "e", "consulta": "c", "unidade": "un"}
+
+_SQL_FOLHAS = """
+    SELECT p.*,
+           pa.nome AS paciente_nome,
+           pa.cpf AS paciente_cpf,
+           COALESCE(e.nome, c.especialidade) AS nome_solicitacao,
+           e.nome AS exame_nome,
+           c.nome AS consulta_nome,
+           un.nome AS unidade_nome,
+           {colunas}
+    FROM pedidos p
+    JOIN pacientes pa ON pa.id = p.paciente_id
+    LEFT JOIN exames e ON e.id = p.exame_id
+    LEFT JOIN consultas c ON c.id = p.consulta_id
+    LEFT JOIN unidades_saude un ON un.id = p.unidade_id
+    WHERE p.id IN ({marcadores})
+"""
+_COLUNAS_PARTES_FOLHA = ",\n           ".join(
+    f"{_ALIAS_FOLHA[parte]}.{coluna} AS {parte}__{coluna}"
+    for parte, colunas in _COLUNAS_FOLHA.items()
+    for coluna in colunas
+)
+
+_SQL_HISTORICOS = """
+    SELECT h.id,
+           h.pedido_id,
+           h.status,
+           h.descricao,
+           h.criado_em,
+           u.nome AS usuario_nome
+    FROM historico_pedidos h
+    JOIN usuarios u ON u.id = h.criado_por
+    WHERE h.pedido_id IN ({marcadores})
+    ORDER BY h.pedido_id, h.criado_em DESC
+"""
+
+
+def _marcadores(quantidade: int) -> str:
+    return ", ".join(["%s"] * quantidade)
+
+
+def _carregar_historicos(cursor, ids: List[int]) -> dict[int, list[dict]]:
+    historicos: dict[int, list[dict]] = {pedido_id: [] for pedido_id in ids}
+    if ids:
+        cursor.execute(_SQL_HISTORICOS.format(marcadores=_marcadores(len(ids))), tuple(ids))
+        for linha in cursor.fetchall():
+            historicos[linha["pedido_id"]].append(linha)
+    return historicos
+
+
+def obter_folhas(pedido_ids: List[int]) -> List[dict]:
+    """
+    Agregados da folha de impressão de vários pedidos com uma conexão e duas
+    consultas (JOIN com ``IN`` e históricos com ``IN``), na ordem de
+    ``pedido_ids``; ids inexistentes são ignorados. Cada item é
+    ``{"pedido", "paciente", "exame", "consulta", "unidade", "historico"}``,
+    com exame/consulta/unidade ``None`` quando o pedido não os referencia.
+    """
+    ids = list(dict.fromkeys(int(i) for i in pedido_ids))
+    if not ids:
+        return []
+
+    query = _SQL_FOLHAS.format(colunas=_COLUNAS_PARTES_FOLHA, marcadores=_marcadores(len(ids)))
+    with mysql.get_cursor(dictionary=True) as (_, cursor):
+        cursor.execute(query, tuple(ids))
+        linhas = {linha["id"]: linha for linha in cursor.fetchall()}
+        historicos = _carregar_historicos(cursor, [i for i in ids if i in linhas])
+
+    folhas = []
+    for pedido_id in ids:
+        linha = linhas.get(pedido_id)
+        if linha is None:
+            continue
+        folha: dict = {"historico": historicos[pedido_id]}
+        for parte, colunas in _COLUNAS_FOLHA.items():
+            valores = {coluna: linha.pop(f"{parte}__{coluna}") for coluna in colunas}
+            folha[parte] = valores if valores["id"] is not None else None
+        folha["pedido"] = linha
+        folhas.append(folha)
+    return folhas
+
+
+def obter_folha(pedido_id: int) -> Optional[dict]:
+    """Agregado da folha de impressão de um pedido (ver ``obter_folhas``)."""
+    folhas = obter_folhas([pedido_id])
+    return folhas[0] if folhas else None
+
+
+def ids_para_impressao(
+    unidade_id: Optional[int] = None,
+    dia: Optional[date] = None,
+    status: tuple = (StatusPedido.AGENDAMENTO_CONFIRMADO,),
+    limite: int = 500,
+) -> List[int]:
+    """
+    Ids dos pedidos nos ``status`` dados atualizados em ``dia`` (ex.: "todos
+    confirmados hoje na unidade X"), na ordem em que chegaram ao status.
+    Range em ``idx_pedidos_unidade_status`` ou ``idx_pedidos_status_atualizacao``.
+    """
+    dia = dia or date.today()
+    valores_status = [StatusPedido(s).value for s in status]
+    filtros = [f"p.status IN ({_marcadores(len(valores_status))})"]
+    params: list = list(valores_status)
+    if unidade_id:
+        filtros.append("p.unidade_id = %s")
+        params.append(unidade_id)
+    filtros.append("p.data_atualizacao >= %s AND p.data_atualizacao < %s")
+    params.extend([dia, dia + timedelta(days=1)])
+    query = f"""
+        SELECT p.id
+        FROM pedidos p
+        WHERE {" AND ".join(filtros)}
+        ORDER BY p.data_atualizacao, p.id
+        LIMIT %s
+    """
+    params.append(limite)
+    with mysql.get_cursor(dictionary=False, readonly=True) as (_, cursor):
+        cursor.execute(query, tuple(params))
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+# ==========================================================
+# 📋 Listagem paginada (keyset em data_atualizacao, id)
+# ==========================================================
+_CHAVE_PAGINACAO = ("data_atualizacao", "id")
+
+
+def _condicao_keyset(colunas: tuple, chave: tuple, descendente: bool = True) -> tuple[str, list]:
+    """
+    Predicado "depois da chave" sobre as colunas de ordenação (a última é o
+    desempate único), expandido em ORs para o otimizador usar range no índice.
+    """
+    operador = "<" if descendente else ">"
+    ramos, params = [], []
+    for i, coluna in enumerate(colunas):
+        iguais = [f"{anterior} = %s" for anterior in colunas[:i]]
+        ramos.append("(" + " AND ".join(iguais + [f"{coluna} {operador} %s"]) + ")")
+        params.extend(chave[: i + 1])
+    return "(" + " OR ".join(ramos) + ")", params
+
+
+def _filtros_fila(
+    filtros: list,
+    params: list,
+    unidade_id: Optional[int],
+    categoria: Optional[str],
+    cpf: Optional[str],
+    nome: Optional[str],
+) -> None:
+    """
+    Acrescenta os filtros comuns das filas: unidade, categoria, documento
+    (CPF ou Cartão SUS, ver ``pacientes.condicao_documento``) e nome.
+    """
+    if unidade_id:
+        filtros.append("p.unidade_id = %s")
+        params.append(unidade_id)
+    if categoria in ("exame", "consulta"):
+        filtros.append("p.tipo_solicitacao = %s")
+        params.append(categoria)
+
+    for condicao, valores in (condicao_documento(cpf), _condicao_nome(nome)):
+        if condicao:
+            filtros.append(condicao)
+            params.extend(valores)
+
+
+def _condicao_nome(nome: Optional[str]) -> tuple[Optional[str], list]:
+    """
+    Prefixo do nome sem acentos/maiúsculas ("joao" encontra "João"), em
+    ``pacientes.nome_busca`` (range em ``idx_pacientes_nome_busca``).
+    """
+    termo = normalizar_nome(nome or "")
+    if not termo:
+        return None, []
+    return "pa.nome_busca LIKE %s", [escapar_like(termo) + "%"]
+
+
+def ids_por_nome_paciente(nome: str, status: Optional[tuple] = None, limite: int = 500) -> List[int]:
+    """
+    Ids dos pedidos de pacientes cujo nome começa com ``nome`` (sem acentos),
+    opcionalmente restritos a ``status``. Parte do índice de nome e chega aos
+    pedidos por ``idx_pedidos_paciente_solicitacao``, sem varrer a fila.
+    """
+    condicao, params = _condicao_nome(nome)
+    if not condicao:
+        return []
+    filtros = [condicao]
+    if status:
+        filtros.append(f"p.status IN ({', '.join(['%s'] * len(status))})")
+        params.extend(StatusPedido(s).value for s in status)
+    query = f"""
+        SELECT p.id
+        FROM pacientes pa
+        JOIN pedidos p ON p.paciente_id = pa.id
+        WHERE {" AND ".join(filtros)}
+        LIMIT %s
+    """
+    params.append(limite)
+    with mysql.get_cursor(dictionary=False, readonly=True) as (_, cur):
+        cur.execute(query, tuple(params))
+        return [linha[0] for linha in cur.fetchall()]
+
+
+def _contar_por_unidade(status: tuple) -> List[dict]:
+    """Total por unidade dos pedidos nos status dados, coberto por idx_pedidos_status_unidade."""
+    marcadores = ", ".join(["%s"] * len(status))
+    query = f"""
+        SELECT un.id, un.nome, f.total
+        FROM (
+            SELECT p.unidade_id, COUNT(*) AS total
+            FROM pedidos p
+            WHERE p.status IN ({marcadores})
+            GROUP BY p.unidade_id
+        ) f
+        JOIN unidades_saude un ON un.id = f.unidade_id
+        ORDER BY un.nome
+    """
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cur):
+        cur.execute(query, tuple(status))
+        return cur.fetchall()
+
+
+def _listar_pagina(filtros: List[str], params: list, limite: int, cursor: Optional[str]) -> Pagina:
+    """
+    Página ordenada por ``data_atualizacao DESC, id DESC``. A posição vem do
+    cursor (última linha da página anterior), então o custo não depende de
+    quantas páginas já foram percorridas, ao contrário de OFFSET.
+    """
+    filtros = list(filtros)
+    params = list(params)
+    chave = decodificar_cursor(cursor, len(_CHAVE_PAGINACAO))
+    if chave:
+        condicao, valores = _condicao_keyset(("p.data_atualizacao", "p.id"), chave)
+        filtros.append(condicao)
+        params.extend(valores)
+
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    query = f"""
         SELECT p.id,
                p.status,
                p.tipo_regulacao,
                p.prioridade,
                p.tipo_solicitacao,
                p.data_solicitacao,
-               p.motivo_devolucao,
-               p.motivos_devolucao_checkboxes,
+               p.data_atualizacao,
+               p.pendente_recepcao,
                pa.nome AS paciente_nome,
                pa.cpf AS paciente_cpf,
                COALESCE(e.nome, c.especialidade) AS nome_solicitacao,
@@ -122,18 +437,28 @@ def listar_devolvidos_por_unidade(unidade_id: int) -> List[dict]:
         LEFT JOIN exames e ON e.id = p.exame_id
         LEFT JOIN consultas c ON c.id = p.consulta_id
         JOIN unidades_saude un ON un.id = p.unidade_id
-        WHERE p.unidade_id = %s AND p.status = %s
-        ORDER BY p.data_atualizacao DESC
+        {where}
+        ORDER BY p.data_atualizacao DESC, p.id DESC
+        LIMIT %s
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(query, (unidade_id, "devolvido_medico_para_recepcao"))
-        return cursor.fetchall()
+    params.append(limite + 1)
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cur):
+        cur.execute(query, tuple(params))
+        linhas = cur.fetchall()
+    return montar_pagina(linhas, limite, _CHAVE_PAGINACAO)
+
+
+# ==========================================================
+# 📋 Listar por unidade
+# ==========================================================
+def listar_por_unidade(unidade_id: int, limite: int = 50, cursor: Optional[str] = None) -> Pagina:
+    return _listar_pagina(["p.unidade_id = %s"], [unidade_id], limite, cursor)
 
 
 # ==========================================================
-# 📋 Listar todos os pedidos (para admin)
+# 📋 Listar pedidos devolvidos por unidade
 # ==========================================================
-def listar_todos() -> List[dict]:
+def listar_devolvidos_por_unidade(unidade_id: int) -> List[dict]:
     query = """
         SELECT p.id,
                p.status,
@@ -141,7 +466,8 @@ def listar_todos() -> List[dict]:
                p.prioridade,
                p.tipo_solicitacao,
                p.data_solicitacao,
-               p.pendente_recepcao,
+               p.motivo_devolucao,
+               p.motivos_devolucao_checkboxes,
                pa.nome AS paciente_nome,
                pa.cpf AS paciente_cpf,
                COALESCE(e.nome, c.especialidade) AS nome_solicitacao,
@@ -151,13 +477,52 @@ def listar_todos() -> List[dict]:
         LEFT JOIN exames e ON e.id = p.exame_id
         LEFT JOIN consultas c ON c.id = p.consulta_id
         JOIN unidades_saude un ON un.id = p.unidade_id
+        WHERE p.unidade_id = %s AND p.status = %s
         ORDER BY p.data_atualizacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(query)
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
+        cursor.execute(query, (unidade_id, "devolvido_medico_para_recepcao"))
         return cursor.fetchall()
 
 
+# ==========================================================
+# 📋 Listar todos os pedidos, paginado (para admin)
+# ==========================================================
+def listar_todos_paginado(limite: int = 50, cursor: Optional[str] = None) -> Pagina:
+    return _listar_pagina([], [], limite, cursor)
+
+
+# ==========================================================
+# 🗂 Recepção Regulação (pedidos com agendamento confirmado)
+# ==========================================================
+STATUS_REGULACAO_RECEPCAO = (StatusPedido.AGENDAMENTO_CONFIRMADO,)
+
+
+def listar_para_regulacao(
+    unidade_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    cpf: Optional[str] = None,
+    nome: Optional[str] = None,
+    status: tuple = STATUS_REGULACAO_RECEPCAO,
+    limite: int = 50,
+    cursor: Optional[str] = None,
+) -> Pagina:
+    """
+    Pedidos nos ``status`` dados, mais recentes primeiro. Usa
+    ``idx_pedidos_status_atualizacao`` ou, com unidade,
+    ``idx_pedidos_unidade_status``.
+    """
+    valores_status = [StatusPedido(s).value for s in status]
+    filtros = [f"p.status IN ({', '.join(['%s'] * len(valores_status))})"]
+    params: list = list(valores_status)
+    _filtros_fila(filtros, params, unidade_id, categoria, cpf, nome)
+    return _listar_pagina(filtros, params, limite, cursor)
+
+
+def contar_regulacao_por_unidade(status: tuple = STATUS_REGULACAO_RECEPCAO) -> List[dict]:
+    return _contar_por_unidade(tuple(StatusPedido(s).value for s in status))
+
+
 # ==========================================================
 # 📋 Listar todos os pedidos devolvidos (para admin) - NOVA
 # ==========================================================
@@ -184,7 +549,7 @@ def listar_devolvidos_todas_unidades() -> List[dict]:
         WHERE p.status = %s
         ORDER BY p.data_atualizacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, ("devolvido_medico_para_recepcao",))
         return cursor.fetchall()
 
@@ -214,62 +579,139 @@ def listar_todos_devolvidos() -> List[dict]:
         WHERE p.status = %s
         ORDER BY p.data_atualizacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, ("devolvido_medico_para_recepcao",))
         return cursor.fetchall()
 
 
 # ==========================================================
-# 📦 Listar para Malote - ATUALIZADO
+# 📦 Listar para Malote - filtros no SQL e paginação por cursor
 # ==========================================================
-def listar_para_malote() -> List[dict]:
-    query = """
-        SELECT p.id,
-               p.status,
-               p.prioridade,
-               p.tipo_regulacao,
-               p.tipo_solicitacao,
-               p.data_solicitacao,
-               un.nome AS unidade_nome,
-               pa.nome AS paciente_nome,
-               pa.cpf AS paciente_cpf,
-               COALESCE(e.nome, c.especialidade) AS nome_solicitacao
-        FROM pedidos p
-        JOIN pacientes pa ON pa.id = p.paciente_id
-        LEFT JOIN exames e ON e.id = p.exame_id
-        LEFT JOIN consultas c ON c.id = p.consulta_id
-        JOIN unidades_saude un ON un.id = p.unidade_id
-        WHERE p.status IN (%s, %s)
-        ORDER BY un.nome, p.data_solicitacao
+STATUS_MALOTE = (
+    StatusPedido.AGUARDANDO_TRIAGEM.value,
+    StatusPedido.DEVOLVIDO_SEM_CONTATO.value,
+)
+
+
+def listar_para_malote(
+    unidade_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    cpf: Optional[str] = None,
+    nome: Optional[str] = None,
+    limite: int = 50,
+    cursor: Optional[str] = None,
+) -> Pagina:
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(
-            query,
-            (
-                StatusPedido.AGUARDANDO_TRIAGEM.value,
-                StatusPedido.DEVOLVIDO_SEM_CONTATO.value,
-            ),
-        )
-        return cursor.fetchall()
+    Fila do malote em ordem de chegada (data_solicitacao, id). Documento e
+    nome pelos índices de ``pacientes`` (ver ``_filtros_fila``).
+
+    Um ``status IN (...)`` com ORDER BY na coluna seguinte do índice obriga
+    o MySQL a ordenar a fila inteira (filesort). Por isso cada status é lido
+    num ramo próprio já na ordem do índice (``idx_pedidos_status_solicitacao``
+    ou, com unidade, ``idx_pedidos_status_unidade``), limitado ao tamanho da
+    página; só as poucas linhas dos ramos são ordenadas no UNION.
+    """
+    filtros: list = []
+    params: list = []
+    _filtros_fila(filtros, params, unidade_id, categoria, cpf, nome)
+
+    chave = decodificar_cursor(cursor, 2)
+    if chave:
+        condicao, valores = _condicao_keyset(("p.data_solicitacao", "p.id"), chave, descendente=False)
+        filtros.append(condicao)
+        params.extend(valores)
+
+    where = " AND ".join(["p.status = %s", *filtros])
+    ramo = f"""
+        (SELECT p.id,
+                p.status,
+                p.prioridade,
+                p.tipo_regulacao,
+                p.tipo_solicitacao,
+                p.data_solicitacao,
+                p.versao,
+                un.nome AS unidade_nome,
+                pa.nome AS paciente_nome,
+                pa.cpf AS paciente_cpf,
+                COALESCE(e.nome, c.especialidade) AS nome_solicitacao
+         FROM pedidos p
+         JOIN pacientes pa ON pa.id = p.paciente_id
+         LEFT JOIN exames e ON e.id = p.exame_id
+         LEFT JOIN consultas c ON c.id = p.consulta_id
+         JOIN unidades_saude un ON un.id = p.unidade_id
+         WHERE {where}
+         ORDER BY p.data_solicitacao ASC, p.id ASC
+         LIMIT %s)
+    """
+    query = " UNION ALL ".join([ramo] * len(STATUS_MALOTE)) + " ORDER BY data_solicitacao ASC, id ASC LIMIT %s"
+    todos: list = []
+    for status in STATUS_MALOTE:
+        todos.extend([status, *params, limite + 1])
+    todos.append(limite + 1)
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cur):
+        cur.execute(query, tuple(todos))
+        linhas = cur.fetchall()
+    return montar_pagina(linhas, limite, ("data_solicitacao", "id"))
+
+
+def contar_malote_por_unidade() -> List[dict]:
+    """Unidades com pedidos na fila do malote (id, nome, total) para o filtro."""
+    return _contar_por_unidade(STATUS_MALOTE)
 
 
 # ==========================================================
-# 🩺 Listar para Médico Regulador
+# 🩺 Listar para Médico Regulador - filtros no SQL e paginação por cursor
 # ==========================================================
-def listar_para_medico(tipo_regulacao: str) -> List[dict]:
-    if tipo_regulacao not in ("municipal", "estadual"):
-        return []
-    status_esperado = (
-        StatusPedido.AGUARDANDO_ANALISE_MEDICO_MUNICIPAL.value
-        if tipo_regulacao == "municipal"
-        else StatusPedido.AGUARDANDO_ANALISE_MEDICO_ESTADUAL.value
-    )
-    query = """
+def _status_medico(tipo_regulacao: str) -> Optional[str]:
+    if tipo_regulacao == "municipal":
+        return StatusPedido.AGUARDANDO_ANALISE_MEDICO_MUNICIPAL.value
+    if tipo_regulacao == "estadual":
+        return StatusPedido.AGUARDANDO_ANALISE_MEDICO_ESTADUAL.value
+    return None
+
+
+def listar_para_medico(
+    tipo_regulacao: str,
+    unidade_id: Optional[int] = None,
+    categoria: Optional[str] = None,
+    cpf: Optional[str] = None,
+    nome: Optional[str] = None,
+    limite: int = 50,
+    cursor: Optional[str] = None,
+    usuario_id: Optional[int] = None,
+) -> Pagina:
+    """
+    Fila do regulador por (prioridade, data_solicitacao, id), percorrida pelo
+    índice ``idx_pedidos_status_prioridade``; com unidade, pelo
+    ``idx_pedidos_status_unidade_prioridade``. Com ``usuario_id``, omite os pedidos
+    reservados (e dentro do prazo) por outros reguladores.
+    """
+    status_esperado = _status_medico(tipo_regulacao)
+    if status_esperado is None:
+        return Pagina(limite=limite)
+
+    filtros = ["p.status = %s"]
+    params: list = [status_esperado]
+    _filtros_fila(filtros, params, unidade_id, categoria, cpf, nome)
+    if usuario_id is not None:
+        filtros.append("(p.reservado_ate IS NULL OR p.reservado_ate <= NOW() OR p.reservado_por = %s)")
+        params.append(usuario_id)
+
+    chave = decodificar_cursor(cursor, 3)
+    if chave:
+        condicao, valores = _condicao_keyset(
+            ("p.prioridade", "p.data_solicitacao", "p.id"), chave, descendente=False
+        )
+        filtros.append(condicao)
+        params.extend(valores)
+
+    query = f"""
         SELECT p.id,
                p.prioridade,
                p.status,
                p.tipo_solicitacao,
                p.motivo_devolucao,
+               p.versao,
                pa.nome AS paciente_nome,
                pa.cpf AS paciente_cpf,
                pa.telefone_principal,
@@ -281,40 +723,170 @@ def listar_para_medico(tipo_regulacao: str) -> List[dict]:
         LEFT JOIN exames e ON e.id = p.exame_id
         LEFT JOIN consultas c ON c.id = p.consulta_id
         JOIN unidades_saude un ON un.id = p.unidade_id
-        WHERE p.status = %s
-        ORDER BY p.prioridade ASC, p.data_solicitacao ASC
+        WHERE {" AND ".join(filtros)}
+        ORDER BY p.prioridade ASC, p.data_solicitacao ASC, p.id ASC
+        LIMIT %s
     """
+    params.append(limite + 1)
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cur):
+        cur.execute(query, tuple(params))
+        linhas = cur.fetchall()
+    return montar_pagina(linhas, limite, ("prioridade", "data_solicitacao", "id"))
+
+
+def contar_para_medico_por_unidade(tipo_regulacao: str) -> List[dict]:
+    """Pedidos aguardando o regulador por unidade (id, nome, total)."""
+    status_esperado = _status_medico(tipo_regulacao)
+    if status_esperado is None:
+        return []
+    return _contar_por_unidade((status_esperado,))
+
+
+# ==========================================================
+# 🙋 Fila de trabalho do regulador (reserva com prazo)
+# ==========================================================
+def reservar_proximo_para_medico(tipo_regulacao: str, usuario_id: int, segundos: int) -> Optional[int]:
+    """
+    Reserva para ``usuario_id`` o próximo pedido da fila (prioridade,
+    data_solicitacao, id) e devolve o id, ou None se a fila está vazia.
+
+    Se o usuário já tem uma reserva dentro do prazo, ela é renovada em vez
+    de pegar outro pedido. O ``FOR UPDATE SKIP LOCKED`` (MySQL 8+) faz
+    reguladores simultâneos pularem a linha que outro está reservando em
+    vez de esperar por ela; depois do commit, quem protege o pedido é o
+    prazo em ``reservado_ate`` — vencido, ele volta à fila sem varredura.
+    """
+    status_esperado = _status_medico(tipo_regulacao)
+    if status_esperado is None:
+        return None
+
     with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(query, (status_esperado,))
-        return cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT id FROM pedidos
+            WHERE reservado_por = %s AND reservado_ate > NOW() AND status = %s
+            ORDER BY reservado_ate DESC
+            LIMIT 1
+            FOR UPDATE
+            """,
+            (usuario_id, status_esperado),
+        )
+        linha = cursor.fetchone()
+        if linha is not None:
+            _renovar_reservas(cursor, [linha["id"]], usuario_id, segundos)
+            return linha["id"]
+        ids = _reservar_livres(cursor, ["p.status = %s"], [status_esperado], usuario_id, segundos, 1)
+        return ids[0] if ids else None
+
+
+def _reservar_livres(
+    cursor, filtros: list, params: list, usuario_id: int, segundos: int, quantidade: int
+) -> List[int]:
+    """
+    Mecanismo único de reserva (regulador e agendador): pega até
+    ``quantidade`` pedidos sem reserva válida, na ordem da fila, pulando as
+    linhas que outra transação está reservando neste instante.
+
+    As duas filas compartilham reservado_por/reservado_ate, o que só é
+    válido porque os status não se sobrepõem (aguardando_medico_* para o
+    regulador; aprovado_* e agendamento_em_andamento para o agendador) e
+    toda transição de status encerra a reserva (``atualizar_status``), salvo
+    a tentativa sem desfecho, que continua na fila do agendador. Um status
+    novo em ambas as filas exigiria colunas próprias.
+
+    A reserva é imposta nas ações, não só na listagem: as transições do
+    regulador e as tentativas do agendador levantam ``PedidoReservado``
+    sobre pedido reservado a outro usuário.
+    """
+    if quantidade <= 0:
+        return []
+    cursor.execute(
+        f"""
+        SELECT p.id FROM pedidos p
+        WHERE {" AND ".join(filtros)}
+          AND (p.reservado_ate IS NULL OR p.reservado_ate <= NOW())
+        ORDER BY p.prioridade ASC, p.data_solicitacao ASC, p.id ASC
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """,
+        (*params, quantidade),
+    )
+    ids = [linha["id"] for linha in cursor.fetchall()]
+    _renovar_reservas(cursor, ids, usuario_id, segundos)
+    return ids
+
+
+def _renovar_reservas(cursor, ids: Sequence[int], usuario_id: int, segundos: int) -> None:
+    if not ids:
+        return
+    cursor.execute(
+        f"""
+        UPDATE pedidos SET reservado_por = %s, reservado_ate = NOW() + INTERVAL %s SECOND
+        WHERE id IN ({_marcadores(len(ids))})
+        """,
+        (usuario_id, segundos, *ids),
+    )
+
+
+def reserva_ativa(tipo_regulacao: str, usuario_id: int) -> Optional[dict]:
+    """Pedido reservado pelo usuário (dentro do prazo), com as colunas da fila."""
+    status_esperado = _status_medico(tipo_regulacao)
+    if status_esperado is None:
+        return None
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
+        cursor.execute(
+            """
+            SELECT id FROM pedidos
+            WHERE reservado_por = %s AND reservado_ate > NOW() AND status = %s
+            ORDER BY reservado_ate DESC
+            LIMIT 1
+            """,
+            (usuario_id, status_esperado),
+        )
+        linha = cursor.fetchone()
+    return obter_linha_fila(linha["id"]) if linha else None
+
+
+def liberar_reserva(pedido_id: int, usuario_id: int) -> bool:
+    """Devolve à fila um pedido reservado pelo próprio usuário."""
+    with mysql.get_cursor() as (_, cursor):
+        cursor.execute(
+            "UPDATE pedidos SET reservado_por = NULL, reservado_ate = NULL WHERE id = %s AND reservado_por = %s",
+            (pedido_id, usuario_id),
+        )
+        return cursor.rowcount > 0
 
 
 # ==========================================================
 # 📅 Listar para Agendador (com filtros)
 # ==========================================================
+def _status_agendador(tipo_regulacao: str) -> Tuple[str, str]:
+    aprovado = StatusPedido.APROVADO_MUNICIPAL if tipo_regulacao == "municipal" else StatusPedido.APROVADO_ESTADUAL
+    return aprovado.value, StatusPedido.AGENDAMENTO_EM_ANDAMENTO.value
+
+
 def listar_para_agendador(
     tipo_regulacao: str,
     ano: Optional[int] = None,
     mes: Optional[int] = None,
-    prioridade: Optional[str] = None
+    prioridade: Optional[str] = None,
+    nome: Optional[str] = None,
+    documento: Optional[str] = None,
+    reservado_por: Optional[int] = None,
 ) -> List[dict]:
+    """Com ``reservado_por``, só a lista de trabalho reservada a esse agendador."""
 
     if tipo_regulacao not in ("municipal", "estadual"):
         return []
 
-    status_validos = (
-        StatusPedido.APROVADO_MUNICIPAL.value,
-        StatusPedido.AGENDAMENTO_EM_ANDAMENTO.value,
-    ) if tipo_regulacao == "municipal" else (
-        StatusPedido.APROVADO_ESTADUAL.value,
-        StatusPedido.AGENDAMENTO_EM_ANDAMENTO.value,
-    )
+    status_validos = _status_agendador(tipo_regulacao)
 
     # 👉 SELECT unificado: traz exame OU consulta
     query = """
         SELECT 
             p.id,
             p.status,
+            p.versao,
             p.tentativas_contato,
             p.data_solicitacao,
             p.data_exame,
@@ -355,32 +927,135 @@ def listar_para_agendador(
     if prioridade:
         query += " AND p.prioridade = %s"
         params.append(prioridade)
+    if reservado_por is not None:
+        query += " AND p.reservado_por = %s AND p.reservado_ate > NOW()"
+        params.append(reservado_por)
+    for condicao, valores in (_condicao_nome(nome), condicao_documento(documento)):
+        if condicao:
+            query += f" AND {condicao}"
+            params.extend(valores)
 
     query += " ORDER BY p.prioridade ASC, p.data_solicitacao DESC"
 
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, tuple(params))
         return cursor.fetchall()
 
 
+# ==========================================================
+# 📥 Lista de trabalho do agendador (distribuição por reserva)
+# ==========================================================
+def _filtros_agendamento(tipo_regulacao: str, tipo_agendador: Optional[str]) -> Tuple[list, list]:
+    """Fila do agendador; ``tipo_agendador`` (exame/consulta) restringe à especialidade."""
+    filtros = ["p.status IN (%s, %s)", "p.tipo_regulacao = %s"]
+    params: list = [*_status_agendador(tipo_regulacao), tipo_regulacao]
+    if tipo_agendador == "exame":
+        filtros.append("p.exame_id IS NOT NULL")
+    elif tipo_agendador == "consulta":
+        filtros.append("p.consulta_id IS NOT NULL")
+    return filtros, params
+
+
+def liberar_reservas_de_ausentes(tipo_regulacao: str, minutos: int) -> int:
+    """
+    Rebalanceamento: pedidos reservados a agendadores sem sinal de presença
+    (``last_seen``) há ``minutos`` voltam à fila para os demais.
+    """
+    if tipo_regulacao not in ("municipal", "estadual"):
+        return 0
+    filtros, params = _filtros_agendamento(tipo_regulacao, None)
+    query = f"""
+        UPDATE pedidos p
+        JOIN usuarios u ON u.id = p.reservado_por
+        SET p.reservado_por = NULL, p.reservado_ate = NULL
+        WHERE {" AND ".join(filtros)}
+          AND p.reservado_ate > NOW()
+          AND u.last_seen < NOW() - INTERVAL %s MINUTE
+    """
+    with mysql.get_cursor() as (_, cursor):
+        cursor.execute(query, (*params, minutos))
+        return cursor.rowcount
+
+
+def _renovar_lista(cursor, tipo_regulacao: str, usuario_id: int, segundos: int) -> int:
+    filtros, params = _filtros_agendamento(tipo_regulacao, None)
+    cursor.execute(
+        f"""
+        UPDATE pedidos p SET p.reservado_ate = NOW() + INTERVAL %s SECOND
+        WHERE p.reservado_por = %s AND p.reservado_ate > NOW() AND {" AND ".join(filtros)}
+        """,
+        (segundos, usuario_id, *params),
+    )
+    return cursor.rowcount
+
+
+def renovar_lista_agendador(tipo_regulacao: str, usuario_id: int, segundos: int) -> int:
+    """Estende o prazo das reservas do agendador (heartbeat da tela de agendamento)."""
+    if tipo_regulacao not in ("municipal", "estadual"):
+        return 0
+    with mysql.get_cursor() as (_, cursor):
+        return _renovar_lista(cursor, tipo_regulacao, usuario_id, segundos)
+
+
+def completar_lista_agendador(
+    tipo_regulacao: str,
+    usuario_id: int,
+    tipo_agendador: Optional[str],
+    agendadores_ativos: int,
+    maximo: int,
+    segundos: int,
+) -> int:
+    """
+    Renova as reservas do agendador e completa a sua lista de trabalho até a
+    cota, pelo mesmo mecanismo de reserva da fila do regulador. Devolve
+    quantos pedidos ficaram reservados a ele.
+
+    Cota = min(maximo, ⌈pedidos da especialidade / agendadores ativos⌉): a
+    fila é dividida pela carga de quem está presente, em vez de ir inteira
+    para quem abre a tela primeiro.
+    """
+    if tipo_regulacao not in ("municipal", "estadual"):
+        return 0
+    filtros, params = _filtros_agendamento(tipo_regulacao, tipo_agendador)
+    where = " AND ".join(filtros)
+
+    with mysql.get_cursor(dictionary=True) as (_, cursor):
+        cursor.execute(
+            f"""
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(p.reservado_por = %s AND p.reservado_ate > NOW()), 0) AS meus
+            FROM pedidos p
+            WHERE {where}
+            """,
+            (usuario_id, *params),
+        )
+        linha = cursor.fetchone()
+        total, meus = int(linha["total"]), int(linha["meus"])
+
+        _renovar_lista(cursor, tipo_regulacao, usuario_id, segundos)
+
+        cota = min(maximo, -(-total // max(agendadores_ativos, 1)))
+        novos = _reservar_livres(cursor, filtros, params, usuario_id, segundos, cota - meus)
+        return meus + len(novos)
+
+
 # ==========================================================
 # 🕓 Histórico de Pedido
 # ==========================================================
 def obter_historico(pedido_id: int) -> list[dict]:
-    query = """
-        SELECT h.id,
-               h.status,
-               h.descricao,
-               h.criado_em,
-               u.nome AS usuario_nome
-        FROM historico_pedidos h
-        JOIN usuarios u ON u.id = h.criado_por
-        WHERE h.pedido_id = %s
-        ORDER BY h.criado_em DESC
+    return obter_historicos([pedido_id])[pedido_id]
+
+
+def obter_historicos(pedido_ids: List[int]) -> dict[int, list[dict]]:
+    """
+    Históricos de vários pedidos numa única consulta ``IN``, agrupados por
+    pedido_id (mais recentes primeiro). Pedidos sem histórico vêm com lista vazia.
     """
+    ids = list(dict.fromkeys(int(i) for i in pedido_ids))
+    if not ids:
+        return {}
     with mysql.get_cursor(dictionary=True) as (_, cursor):
-        cursor.execute(query, (pedido_id,))
-        return cursor.fetchall()
+        return _carregar_historicos(cursor, ids)
 
 
 # ==========================================================
@@ -410,7 +1085,7 @@ def listar_por_status(status: str) -> List[dict]:
         WHERE p.status = %s
         ORDER BY p.data_solicitacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, (status,))
         return cursor.fetchall()
 
@@ -448,7 +1123,7 @@ def listar_por_paciente(paciente_id: int) -> list[dict]:
         WHERE p.paciente_id = %s
         ORDER BY p.data_solicitacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, (paciente_id,))
         return cursor.fetchall()
 
@@ -479,6 +1154,6 @@ def listar_devolvidos_todas_unidades() -> List[dict]:
         WHERE p.status = %s
         ORDER BY p.data_atualizacao DESC
     """
-    with mysql.get_cursor(dictionary=True) as (_, cursor):
+    with mysql.get_cursor(dictionary=True, readonly=True) as (_, cursor):
         cursor.execute(query, ("devolvido_medico_para_recepcao",))
         return cursor.fetchall()
\ No newline at end of file
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from typing import Any, Optional
 
+from app.database import POOL_CHAT
 from app.extensions import mysql
 
 
@@ -53,14 +54,14 @@ def obter_por_cpf(
         return cursor.fetchone()
 
 
-def obter_por_id(usuario_id: int) -> Optional[dict]:
+def obter_por_id(usuario_id: int, pool: Optional[str] = None) -> Optional[dict]:
     query = """
         SELECT u.*, un.nome AS unidade_nome
         FROM usuarios u
         LEFT JOIN unidades_saude un ON un.id = u.unidade_id
         WHERE u.id = %s
     """
-    with mysql.get_cursor() as (_, cursor):
+    with mysql.get_cursor(pool=pool) as (_, cursor):
         cursor.execute(query, (usuario_id,))
         return cursor.fetchone()
 
@@ -104,4 +105,36 @@ def atualizar_usuario(usuario_id: int, **campos: Any) -> None:
     valores.append(usuario_id)
 
     with mysql.get_cursor() as (_, cursor):
-        cursor.execute(query, tuple(valores))
\ No newline at end of file
+        cursor.execute(query, tuple(valores))
+
+
+def registrar_sinal(usuario_id: int) -> None:
+    """
+    Sinal de vida do agendador na fila (só ``last_seen``). ``is_online`` é do
+    chat e vira FALSE a cada desconexão do socket, inclusive ao navegar.
+    """
+    with mysql.get_cursor(pool=POOL_CHAT) as (_, cursor):
+        cursor.execute("UPDATE usuarios SET last_seen = NOW() WHERE id = %s", (usuario_id,))
+
+
+def contar_agendadores_presentes(role: str, tipo_agendador: Optional[str], minutos: int) -> int:
+    """
+    Agendadores ativos e presentes (com sinal há menos de ``minutos``)
+    que disputam a mesma fila: mesma role e mesma especialidade — os sem
+    especialidade atendem exames e consultas.
+    """
+    query = """
+        SELECT COUNT(*) AS total
+        FROM usuarios u
+        WHERE u.role = %s
+          AND u.ativo = 1
+          AND u.last_seen >= NOW() - INTERVAL %s MINUTE
+    """
+    params: list[Any] = [role, minutos]
+    if tipo_agendador:
+        query += " AND (u.tipo_agendador = %s OR u.tipo_agendador IS NULL)"
+        params.append(tipo_agendador)
+
+    with mysql.get_cursor(readonly=True) as (_, cursor):
+        cursor.execute(query, tuple(params))
+        return cursor.fetchone()["total"]
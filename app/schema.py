@@ -1,3 +1,8 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from app.utils.texto import normalizar_nome, somente_digitos
+
 SCHEMA_STATEMENTS = [
     """
     CREATE TABLE IF NOT EXISTS unidades_saude (
@@ -185,4 +190,152 @@ SCHEMA_STATEMENTS = [
         UNIQUE KEY uq_conversation_user (conversation_id, user_id)
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """
-]
\ No newline at end of file
+]
+
+
+SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        versao INT PRIMARY KEY,
+        descricao VARCHAR(255) NOT NULL,
+        aplicada_em DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+
+@dataclass(frozen=True)
+class Migracao:
+    versao: int
+    descricao: str
+    comandos: tuple[str, ...]
+    # Passo opcional de dados em Python, executado após os comandos com o
+    # mesmo cursor (ex.: preencher colunas derivadas que o SQL não calcula)
+    dados: Optional[Callable[[Any], None]] = None
+
+
+def _atualizar_em_lotes(cursor, coluna_origem: str, coluna_destino: str, converter, lote: int = 1000) -> None:
+    """
+    Preenche ``coluna_destino`` de ``pacientes`` a partir de ``coluna_origem``
+    página a página (por id): cada página é lida e atualizada antes da
+    próxima, sem carregar a tabela inteira na memória.
+    """
+    consulta = (
+        f"SELECT id, {coluna_origem} FROM pacientes "
+        f"WHERE id > %s AND {coluna_origem} IS NOT NULL ORDER BY id LIMIT %s"
+    )
+    comando = f"UPDATE pacientes SET {coluna_destino} = %s WHERE id = %s"
+    ultimo_id = 0
+    while True:
+        cursor.execute(consulta, (ultimo_id, lote))
+        pagina = cursor.fetchall()
+        if not pagina:
+            return
+        cursor.executemany(comando, [(converter(valor), paciente_id) for paciente_id, valor in pagina])
+        ultimo_id = pagina[-1][0]
+
+
+def _preencher_nome_busca(cursor) -> None:
+    _atualizar_em_lotes(cursor, "nome", "nome_busca", normalizar_nome)
+
+
+def _preencher_cartao_sus_busca(cursor) -> None:
+    _atualizar_em_lotes(cursor, "cartao_sus", "cartao_sus_busca", lambda cartao: somente_digitos(cartao) or None)
+
+
+# Migrações em ordem crescente de versão. Nunca altere uma migração já
+# publicada: mudanças de schema (inclusive novos índices) entram como uma
+# nova versão no fim da lista. Cada comando deve poder ser repetido após uma
+# queda antes do registro da versão: ensure_schema ignora tabela, coluna e
+# índice já existentes, e o passo de ``dados`` precisa ser idempotente.
+MIGRACOES: list[Migracao] = [
+    Migracao(1, "Schema inicial", tuple(SCHEMA_STATEMENTS)),
+    Migracao(
+        2,
+        "Índices das filas de pedidos",
+        (
+            # listar_para_medico: status = ? ORDER BY prioridade, data_solicitacao
+            "CREATE INDEX idx_pedidos_status_prioridade ON pedidos (status, prioridade, data_solicitacao)",
+            # listar_para_malote (um ramo por status) / listar_por_status: status = ? ORDER BY data_solicitacao
+            "CREATE INDEX idx_pedidos_status_solicitacao ON pedidos (status, data_solicitacao)",
+            # listar_*devolvidos_todas_unidades: status = ? ORDER BY data_atualizacao
+            "CREATE INDEX idx_pedidos_status_atualizacao ON pedidos (status, data_atualizacao)",
+            # listar_para_agendador: tipo_regulacao = ? AND status IN (...) ORDER BY prioridade, data_solicitacao
+            "CREATE INDEX idx_pedidos_agendador ON pedidos (tipo_regulacao, status, prioridade, data_solicitacao)",
+            # listar_por_unidade: unidade_id = ? ORDER BY data_atualizacao
+            "CREATE INDEX idx_pedidos_unidade_atualizacao ON pedidos (unidade_id, data_atualizacao)",
+            # listar_devolvidos_por_unidade: unidade_id = ? AND status = ? ORDER BY data_atualizacao
+            "CREATE INDEX idx_pedidos_unidade_status ON pedidos (unidade_id, status, data_atualizacao)",
+            # listar_todos: ORDER BY data_atualizacao
+            "CREATE INDEX idx_pedidos_atualizacao ON pedidos (data_atualizacao)",
+            # listar_por_paciente: paciente_id = ? ORDER BY data_solicitacao
+            "CREATE INDEX idx_pedidos_paciente_solicitacao ON pedidos (paciente_id, data_solicitacao)",
+            # obter_historico: pedido_id = ? ORDER BY criado_em
+            "CREATE INDEX idx_historico_pedido_criado ON historico_pedidos (pedido_id, criado_em)",
+        ),
+    ),
+    Migracao(
+        3,
+        "Índice da fila do malote por unidade",
+        (
+            # listar_para_malote: status = ? AND unidade_id = ? ORDER BY data_solicitacao;
+            # contar_malote_por_unidade: GROUP BY unidade_id coberto pelo índice
+            "CREATE INDEX idx_pedidos_status_unidade ON pedidos (status, unidade_id, data_solicitacao)",
+        ),
+    ),
+    Migracao(
+        4,
+        "Busca de pacientes por nome sem acentos",
+        (
+            # nome_busca = app.utils.texto.normalizar_nome(nome), mantida pelo
+            # repositório de pacientes; binária para o LIKE 'prefixo%' virar range
+            "ALTER TABLE pacientes ADD COLUMN nome_busca VARCHAR(150) "
+            "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL DEFAULT ''",
+            "CREATE INDEX idx_pacientes_nome_busca ON pacientes (nome_busca)",
+        ),
+        dados=_preencher_nome_busca,
+    ),
+    Migracao(
+        5,
+        "Busca de pacientes por Cartão SUS",
+        (
+            # cpf já é gravado só com dígitos (CHAR(11) UNIQUE); cartao_sus é
+            # texto livre, então a forma só com dígitos fica numa coluna própria
+            "ALTER TABLE pacientes ADD COLUMN cartao_sus_busca VARCHAR(20) "
+            "CHARACTER SET ascii COLLATE ascii_bin NULL",
+            "CREATE INDEX idx_pacientes_cartao_sus_busca ON pacientes (cartao_sus_busca)",
+        ),
+        dados=_preencher_cartao_sus_busca,
+    ),
+    Migracao(
+        6,
+        "Versão dos pedidos (concorrência otimista)",
+        (
+            # Incrementada em todo UPDATE de pedidos_repo.atualizar_campos; as
+            # transições enviam a versão que a tela exibiu e o UPDATE só casa
+            # se ninguém alterou o pedido nesse meio-tempo
+            "ALTER TABLE pedidos ADD COLUMN versao INT UNSIGNED NOT NULL DEFAULT 0",
+        ),
+    ),
+    Migracao(
+        7,
+        "Reserva de pedidos pelo médico regulador",
+        (
+            # Reserva com prazo: vencida, o pedido volta sozinho para a fila
+            # (o SELECT de reserva ignora reservado_ate no passado). Usadas
+            # também pela lista do agendador: as filas têm status disjuntos
+            # (ver pedidos_repo._reservar_livres)
+            "ALTER TABLE pedidos ADD COLUMN reservado_por INT NULL, "
+            "ADD COLUMN reservado_ate DATETIME NULL",
+            "CREATE INDEX idx_pedidos_reservado_por ON pedidos (reservado_por, reservado_ate)",
+        ),
+    ),
+    Migracao(
+        8,
+        "Índice da fila do regulador por unidade",
+        (
+            # listar_para_medico com unidade: status = ? AND unidade_id = ?
+            # ORDER BY prioridade, data_solicitacao (sem filesort)
+            "CREATE INDEX idx_pedidos_status_unidade_prioridade "
+            "ON pedidos (status, unidade_id, prioridade, data_solicitacao)",
+        ),
+    ),
+]
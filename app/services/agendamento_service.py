@@ -1,10 +1,9 @@
-from datetime import datetime, date, time
+from datetime import date, time
 from typing import Optional
 
 from app.domain.status import StatusPedido
-from app.extensions import mysql
 from app.repositories import pedidos as pedidos_repo
-from .pedidos_service import atualizar_status, registrar_historico
+from .pedidos_service import atualizar_status, transicao
 
 
 def registrar_tentativa(
@@ -15,12 +14,36 @@ def registrar_tentativa(
     data_exame: Optional[date],
     horario_exame: Optional[time],
     local_exame: Optional[str],
+    versao: Optional[int] = None,
+    reservado_para: Optional[int] = None,
 ):
-    with mysql.get_cursor() as (_, cursor):
-        cursor.execute("SELECT status, tentativas_contato, tipo_regulacao FROM pedidos WHERE id = %s", (pedido_id,))
+    """
+    Registra a tentativa de contato e a transição resultante numa única
+    transação. O ``SELECT ... FOR UPDATE`` trava a linha do pedido: dois
+    agendadores no mesmo pedido são serializados e cada um enxerga o
+    contador já incrementado pelo outro. Com ``versao`` (a exibida na tela),
+    uma tentativa feita sobre dados desatualizados levanta ``ConflitoVersao``.
+    Com ``reservado_para`` (o agendador), o pedido precisa estar na lista de
+    trabalho dele (reserva dentro do prazo); senão, ``PedidoReservado``.
+    """
+    with transicao() as cursor:
+        cursor.execute(
+            """
+            SELECT status, tentativas_contato, tipo_regulacao, versao,
+                   reservado_por, reservado_ate > NOW() AS reserva_ativa
+            FROM pedidos WHERE id = %s FOR UPDATE
+            """,
+            (pedido_id,),
+        )
         pedido = cursor.fetchone()
         if not pedido:
             raise ValueError("Pedido não encontrado.")
+        if versao is not None and pedido["versao"] != versao:
+            raise pedidos_repo.ConflitoVersao(pedido_id)
+        if reservado_para is not None and not (pedido["reserva_ativa"] and pedido["reservado_por"] == reservado_para):
+            raise pedidos_repo.PedidoReservado(
+                pedido_id, f"O pedido #{pedido_id} não está mais na sua lista de trabalho. Atualize a página."
+            )
 
         nova_tentativa = (pedido["tentativas_contato"] or 0) + 1
 
@@ -33,39 +56,34 @@ def registrar_tentativa(
             (pedido_id, nova_tentativa, resultado, resumo, usuario_id),  # ✅ REMOVIDO datetime.utcnow()
         )
 
-        cursor.execute(
-            "UPDATE pedidos SET tentativas_contato=%s WHERE id=%s",
-            (nova_tentativa, pedido_id),
-        )
-
-    if resultado == "contato_sucesso":
-        extra = {
-            "data_exame": data_exame,
-            "horario_exame": horario_exame,
-            "local_exame": local_exame,
-            "tentativas_contato": nova_tentativa,
-        }
-        status_final = StatusPedido.AGENDAMENTO_CONFIRMADO
-        atualizar_status(
-            pedido_id=pedido_id,
-            status=status_final,
-            usuario_id=usuario_id,
-            descricao=f"Contato confirmado. Exame agendado para {data_exame} às {horario_exame} em {local_exame}.",
-            extra_campos=extra,
-        )
-    else:
-        if resultado == "sem_contato" and nova_tentativa >= 3:
-            extra = {
-                "pendente_recepcao": 1,
-                "tipo_regulacao": None,
-                "prioridade": None,
-            }
+        # O contador vai no mesmo UPDATE da transição (um único UPDATE por tentativa)
+        if resultado == "contato_sucesso":
+            atualizar_status(
+                pedido_id=pedido_id,
+                status=StatusPedido.AGENDAMENTO_CONFIRMADO,
+                usuario_id=usuario_id,
+                descricao=f"Contato confirmado. Exame agendado para {data_exame} às {horario_exame} em {local_exame}.",
+                extra_campos={
+                    "data_exame": data_exame,
+                    "horario_exame": horario_exame,
+                    "local_exame": local_exame,
+                    "tentativas_contato": nova_tentativa,
+                },
+                cursor=cursor,
+            )
+        elif resultado == "sem_contato" and nova_tentativa >= 3:
             atualizar_status(
                 pedido_id=pedido_id,
                 status=StatusPedido.DEVOLVIDO_SEM_CONTATO,
                 usuario_id=usuario_id,
                 descricao="Três tentativas sem sucesso. Pedido devolvido à recepção da unidade.",
-                extra_campos=extra,
+                extra_campos={
+                    "pendente_recepcao": 1,
+                    "tipo_regulacao": None,
+                    "prioridade": None,
+                    "tentativas_contato": nova_tentativa,
+                },
+                cursor=cursor,
             )
         else:
             atualizar_status(
@@ -74,4 +92,7 @@ def registrar_tentativa(
                 usuario_id=usuario_id,
                 descricao=f"Tentativa registrada com resultado: {resultado}.",
                 extra_campos={"tentativas_contato": nova_tentativa},
-            )
\ No newline at end of file
+                # Segue na lista de trabalho do mesmo agendador
+                manter_reserva=True,
+                cursor=cursor,
+            )
@@ -0,0 +1,40 @@
+from flask import current_app
+
+from app.repositories import pedidos as pedidos_repo
+from app.repositories import usuarios as usuarios_repo
+
+
+def montar_lista_agendador(tipo_regulacao: str, usuario) -> int:
+    """
+    Distribui os pedidos aprovados entre os agendadores presentes e devolve o
+    tamanho da lista de trabalho de ``usuario``.
+
+    Puxada a cada acesso à fila: registra o sinal do agendador, devolve à
+    fila o que estava com agendadores ausentes (rebalanceamento) e completa a
+    lista dele até a cota da sua especialidade (exame/consulta).
+    """
+    config = current_app.config
+    minutos = config["AGENDAMENTO_PRESENCA_MINUTOS"]
+
+    usuarios_repo.registrar_sinal(usuario.id)
+    pedidos_repo.liberar_reservas_de_ausentes(tipo_regulacao, minutos)
+    ativos = usuarios_repo.contar_agendadores_presentes(usuario.role, usuario.tipo_agendador, minutos)
+    return pedidos_repo.completar_lista_agendador(
+        tipo_regulacao,
+        usuario.id,
+        usuario.tipo_agendador,
+        ativos,
+        config["AGENDAMENTO_LISTA_MAXIMA"],
+        config["AGENDAMENTO_RESERVA_SEGUNDOS"],
+    )
+
+
+def manter_lista_agendador(tipo_regulacao: str, usuario) -> int:
+    """
+    Heartbeat da tela de agendamento: renova o sinal de presença e o prazo
+    das reservas, sem redistribuir. Independe do heartbeat do chat.
+    """
+    usuarios_repo.registrar_sinal(usuario.id)
+    return pedidos_repo.renovar_lista_agendador(
+        tipo_regulacao, usuario.id, current_app.config["AGENDAMENTO_RESERVA_SEGUNDOS"]
+    )
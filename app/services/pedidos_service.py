@@ -1,21 +1,61 @@
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional
 
 from app.domain.status import StatusPedido
-from app.extensions import mysql
+from app.extensions import acompanhamento, mysql
 from app.repositories import pedidos as pedidos_repo
 
 
-def registrar_historico(pedido_id: int, status: StatusPedido, descricao: Optional[str], usuario_id: int):
+@contextmanager
+def transicao():
+    """
+    Unidade de trabalho para mudanças de status: uma conexão e um único
+    commit para tudo o que for executado com o cursor entregue.
+
+        with transicao() as cursor:
+            registrar_historico(..., cursor=cursor)
+            atualizar_status(..., cursor=cursor)
+
+    Se qualquer passo falhar, nada é gravado (nem o UPDATE, nem o histórico).
+    Dentro de uma transação já aberta (MYSQL_REQUEST_SCOPED), roda sob
+    SAVEPOINT: a rota que trata um ``ConflitoVersao`` não perde o resto.
+    """
+    with mysql.get_cursor(savepoint=True) as (_, cursor):
+        yield cursor
+
+
+def _invalidar_acompanhamento(pedido_id: int) -> None:
+    # Só depois do commit: invalidar antes deixaria uma consulta concorrente
+    # recolocar no cache a linha do tempo antiga
+    mysql.apos_commit(lambda: acompanhamento.invalidar_pedido(pedido_id))
+
+
+def invalidar_acompanhamento_cpf(cpf: str) -> None:
+    """Pedido novo para o CPF: a consulta pública em cache sai após o commit."""
+    mysql.apos_commit(lambda: acompanhamento.invalidar_cpf(cpf))
+
+
+def registrar_historico(
+    pedido_id: int,
+    status: StatusPedido,
+    descricao: Optional[str],
+    usuario_id: int,
+    cursor=None,
+):
     query = """
         INSERT INTO historico_pedidos (pedido_id, status, descricao, criado_por, criado_em)
         VALUES (%s, %s, %s, %s, NOW())
     """
-    with mysql.get_cursor() as (_, cursor):
-        cursor.execute(
-            query,
-            (pedido_id, status.value, descricao, usuario_id),  # ✅ REMOVIDO datetime.utcnow()
-        )
+    params = (pedido_id, status.value, descricao, usuario_id)  # ✅ REMOVIDO datetime.utcnow()
+    if cursor is not None:
+        cursor.execute(query, params)
+    else:
+        with mysql.get_cursor() as (_, cursor):
+            cursor.execute(query, params)
+    # Toda mudança que aparece na linha do tempo passa por aqui (inclusive
+    # atualizar_status): descarta a consulta pública em cache deste pedido
+    _invalidar_acompanhamento(pedido_id)
 
 
 def atualizar_status(
@@ -24,13 +64,49 @@ def atualizar_status(
     usuario_id: int,
     descricao: Optional[str] = None,
     extra_campos: Optional[dict] = None,
+    versao: Optional[int] = None,
+    manter_reserva: bool = False,
+    reservado_para: Optional[int] = None,
+    cursor=None,
 ):
+    """
+    UPDATE do pedido + registro no histórico na mesma transação. Sem
+    ``cursor``, abre a sua própria (ou entra na já aberta no contexto);
+    com ``cursor`` de ``transicao()``, compõe com outras transições.
+
+    ``versao`` é a versão do pedido que a tela exibiu: se outro usuário o
+    alterou antes, levanta ``pedidos_repo.ConflitoVersao`` e nada é gravado.
+    A reserva do pedido (regulador/agendador) acaba na transição, a menos
+    que ``manter_reserva`` — ele continua na lista de quem o está tratando.
+    Com ``reservado_para`` (o usuário da ação), um pedido reservado a outro
+    usuário levanta ``pedidos_repo.PedidoReservado``.
+    """
+    if cursor is None:
+        with transicao() as cursor:
+            atualizar_status(
+                pedido_id,
+                status,
+                usuario_id,
+                descricao,
+                extra_campos,
+                versao=versao,
+                manter_reserva=manter_reserva,
+                reservado_para=reservado_para,
+                cursor=cursor,
+            )
+        return
+
     campos = {
         "status": status.value,
         "usuario_atualizacao": usuario_id,
         "pendente_recepcao": 0,
     }
+    if not manter_reserva:
+        campos["reservado_por"] = None
+        campos["reservado_ate"] = None
     if extra_campos:
         campos.update(extra_campos)
-    pedidos_repo.atualizar_campos(pedido_id, campos)
-    registrar_historico(pedido_id, status, descricao, usuario_id)
\ No newline at end of file
+    pedidos_repo.atualizar_campos(
+        pedido_id, campos, cursor=cursor, versao=versao, reservado_para=reservado_para
+    )
+    registrar_historico(pedido_id, status, descricao, usuario_id, cursor=cursor)
@@ -0,0 +1,155 @@
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Optional
+
+from .pool import origem_chamada
+
+logger = logging.getLogger(__name__)
+
+_RE_ESPACOS = re.compile(r"\s+")
+_RE_STRINGS = re.compile(r"'(?:[^'\\]|\\.)*'")
+_RE_NUMEROS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalizar_sql(sql: str) -> str:
+    """Remove literais e espaços para agrupar execuções da mesma instrução."""
+    texto = _RE_ESPACOS.sub(" ", sql).strip()
+    texto = texto.replace("%s", "?")
+    texto = _RE_STRINGS.sub("?", texto)
+    texto = _RE_NUMEROS.sub("?", texto)
+    return _RE_LISTAS.sub("(?+)", texto)
+
+
+class RegistroConsultasLentas:
+    """
+    Ring buffer das instruções que passaram de ``limite_ms``.
+
+    O caminho rápido (instrução abaixo do limite) custa só uma comparação.
+    Para SELECTs lentos, o ``EXPLAIN FORMAT=JSON`` é capturado em segundo
+    plano (uma vez por instrução normalizada), fora da requisição que sofreu
+    a lentidão. Os planos ficam num LRU de ``capacidade_explains`` entradas:
+    SQL montado dinamicamente (listas IN, filtros opcionais) gera formas
+    normalizadas sem fim.
+    """
+
+    def __init__(
+        self,
+        limite_ms: float,
+        obter_conexao: Callable[[], Any],
+        capacidade: int = 100,
+        capacidade_explains: int = 300,
+    ):
+        self.limite = limite_ms / 1000.0
+        self.obter_conexao = obter_conexao
+        self._lock = threading.Lock()
+        self._entradas: Deque[dict] = deque(maxlen=capacidade)
+        self._capacidade_explains = capacidade_explains
+        self._explains: "OrderedDict[str, Any]" = OrderedDict()
+        self._explicando: set[str] = set()
+
+    def registrar(self, sql: str, params, duracao: float, linhas: Optional[int]) -> None:
+        if duracao < self.limite:
+            return
+
+        normalizada = normalizar_sql(sql)
+        entrada = {
+            "sql": normalizada,
+            "origem": origem_chamada(),
+            "duracao_ms": round(duracao * 1000, 2),
+            "parametros": len(params) if params else 0,
+            "linhas": linhas if linhas is not None and linhas >= 0 else None,
+            "registrada_em": datetime.now().isoformat(timespec="seconds"),
+        }
+        logger.warning(
+            "Consulta lenta (%.0fms) em %s: %s", entrada["duracao_ms"], entrada["origem"], normalizada[:300]
+        )
+
+        explicar = False
+        with self._lock:
+            self._entradas.append(entrada)
+            if normalizada in self._explains:
+                self._explains.move_to_end(normalizada)
+            elif (
+                normalizada not in self._explicando
+                and sql.lstrip()[:6].upper() in ("SELECT", "WITH")
+            ):
+                self._explicando.add(normalizada)
+                explicar = True
+
+        if explicar:
+            threading.Thread(
+                target=self._capturar_explain,
+                args=(normalizada, sql, params),
+                name="slowlog-explain",
+                daemon=True,
+            ).start()
+
+    def _capturar_explain(self, normalizada: str, sql: str, params) -> None:
+        plano: Any = None
+        try:
+            conexao = self.obter_conexao()
+            try:
+                cursor = conexao.cursor()
+                try:
+                    cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+                    linha = cursor.fetchone()
+                finally:
+                    cursor.close()
+                conexao.rollback()
+            finally:
+                conexao.close()
+            plano = json.loads(linha[0]) if linha and linha[0] else None
+        except Exception as exc:
+            logger.debug("Falha ao capturar EXPLAIN.", exc_info=True)
+            plano = {"erro": str(exc)}
+        finally:
+            with self._lock:
+                self._explicando.discard(normalizada)
+                self._explains[normalizada] = plano
+                while len(self._explains) > self._capacidade_explains:
+                    self._explains.popitem(last=False)
+
+    def piores(self, limite: int = 20) -> list[dict]:
+        """Instruções normalizadas ordenadas pela pior duração observada."""
+        with self._lock:
+            entradas = list(self._entradas)
+            explains = dict(self._explains)
+
+        agrupadas: dict[str, dict] = {}
+        for entrada in entradas:
+            grupo = agrupadas.get(entrada["sql"])
+            if grupo is None:
+                grupo = agrupadas[entrada["sql"]] = {
+                    "sql": entrada["sql"],
+                    "origens": set(),
+                    "execucoes": 0,
+                    "duracao_total_ms": 0.0,
+                    "duracao_max_ms": 0.0,
+                    "parametros": entrada["parametros"],
+                    "linhas": entrada["linhas"],
+                    "ultima_em": entrada["registrada_em"],
+                }
+            grupo["origens"].add(entrada["origem"])
+            grupo["execucoes"] += 1
+            grupo["duracao_total_ms"] += entrada["duracao_ms"]
+            if entrada["duracao_ms"] >= grupo["duracao_max_ms"]:
+                grupo["duracao_max_ms"] = entrada["duracao_ms"]
+                grupo["linhas"] = entrada["linhas"]
+            grupo["ultima_em"] = entrada["registrada_em"]
+
+        resultado = sorted(agrupadas.values(), key=lambda g: g["duracao_max_ms"], reverse=True)[:limite]
+        for grupo in resultado:
+            grupo["origens"] = sorted(grupo["origens"])
+            grupo["duracao_media_ms"] = round(grupo["duracao_total_ms"] / grupo["execucoes"], 2)
+            grupo["explain"] = explains.get(grupo["sql"])
+        return resultado
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._explains.clear()
@@ -0,0 +1,44 @@
+// Ações nas linhas das filas (formulários com data-linha-pedido).
+// O formulário é enviado via fetch: em caso de sucesso a página recarrega
+// (mantendo filtros e a mensagem flash); em conflito de versão (409) só a
+// linha do pedido é trocada pela versão atual devolvida pelo servidor.
+document.addEventListener('submit', async (evento) => {
+  const form = evento.target;
+  const pedidoId = form.dataset ? form.dataset.linhaPedido : null;
+  if (!pedidoId) return;
+  evento.preventDefault();
+
+  let resposta;
+  try {
+    resposta = await fetch(form.action, {
+      method: 'POST',
+      body: new FormData(form),
+      headers: { 'X-Requested-With': 'fetch' },
+      credentials: 'same-origin',
+      redirect: 'manual',
+    });
+  } catch (erro) {
+    form.submit();
+    return;
+  }
+
+  if (resposta.status !== 409) {
+    window.location.reload();
+    return;
+  }
+
+  const dados = await resposta.json();
+  if (typeof fecharModal === 'function') fecharModal();
+
+  const linha = document.getElementById(`pedido-${pedidoId}`);
+  if (!linha) {
+    window.location.reload();
+    return;
+  }
+  if (dados.html) {
+    linha.outerHTML = dados.html;
+  } else {
+    linha.remove();
+    alert(dados.mensagem);
+  }
+});
@@ -0,0 +1,25 @@
+from typing import Callable, Optional
+
+from flask import flash, jsonify, redirect, request
+
+
+def versao_do_form() -> Optional[int]:
+    """Versão do pedido exibida na tela (campo hidden ``versao``)."""
+    return request.form.get("versao", type=int)
+
+
+def requisicao_fetch() -> bool:
+    """Ação enviada por static/js/linhas.js (e não por submit comum)."""
+    return request.headers.get("X-Requested-With") == "fetch"
+
+
+def responder_conflito(erro, destino: str, renderizar_linha: Callable[[], str]):
+    """
+    Resposta a um ``ConflitoVersao``. Via fetch: 409 com o HTML atualizado só
+    da linha do pedido (vazio se ele não existe mais), que o script troca na
+    tabela. Sem JavaScript: flash + volta para a fila.
+    """
+    if requisicao_fetch():
+        return jsonify({"conflito": True, "mensagem": str(erro), "html": renderizar_linha()}), 409
+    flash(str(erro), "warning")
+    return redirect(destino)
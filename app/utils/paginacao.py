@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Optional, Sequence
+
+from flask import current_app, request
+
+
+@dataclass
+class Pagina:
+    """Resultado de uma consulta paginada por cursor (keyset)."""
+
+    itens: list[dict] = field(default_factory=list)
+    proximo_cursor: Optional[str] = None
+    limite: int = 50
+
+    @property
+    def tem_proxima(self) -> bool:
+        return self.proximo_cursor is not None
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self) -> int:
+        return len(self.itens)
+
+
+def _serializar(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return {"dt": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"d": valor.isoformat()}
+    return valor
+
+
+def _desserializar(valor: Any) -> Any:
+    if isinstance(valor, dict):
+        if "dt" in valor:
+            return datetime.fromisoformat(valor["dt"])
+        if "d" in valor:
+            return date.fromisoformat(valor["d"])
+        raise ValueError("Valor de cursor inválido.")
+    return valor
+
+
+def codificar_cursor(valores: Sequence[Any]) -> str:
+    """Gera o token opaco (base64 urlsafe) com a chave da última linha da página."""
+    bruto = json.dumps([_serializar(v) for v in valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token: Optional[str], quantidade: int) -> Optional[tuple]:
+    """
+    Devolve a tupla da chave codificada em ``token`` ou ``None`` quando o token
+    está ausente ou é inválido (nesse caso a lista recomeça da primeira página).
+    """
+    if not token:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        valores = json.loads(bruto)
+        if not isinstance(valores, list) or len(valores) != quantidade:
+            return None
+        return tuple(_desserializar(v) for v in valores)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def montar_pagina(linhas: list[dict], limite: int, colunas_chave: Sequence[str]) -> Pagina:
+    """
+    Recebe até ``limite + 1`` linhas: a linha excedente só indica que existe
+    próxima página e é descartada.
+    """
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        proximo = codificar_cursor([ultima[coluna] for coluna in colunas_chave])
+    return Pagina(itens=linhas, proximo_cursor=proximo, limite=limite)
+
+
+def limite_da_requisicao(parametro: str = "limite") -> int:
+    """Tamanho de página pedido na query string, restrito aos limites configurados."""
+    padrao = current_app.config.get("PAGINACAO_TAMANHO_PADRAO", 50)
+    maximo = current_app.config.get("PAGINACAO_TAMANHO_MAXIMO", 200)
+    limite = request.args.get(parametro, type=int) or padrao
+    return max(1, min(limite, maximo))
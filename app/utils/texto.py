@@ -0,0 +1,24 @@
+import re
+import unicodedata
+
+_RE_ESPACOS = re.compile(r"\s+")
+
+
+def normalizar_nome(texto: str) -> str:
+    """
+    Forma de busca de um nome: sem acentos, minúscula e com espaços simples.
+    "  João  da Silva" -> "joao da silva".
+    """
+    decomposto = unicodedata.normalize("NFKD", texto or "")
+    sem_acentos = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return _RE_ESPACOS.sub(" ", sem_acentos).strip().lower()
+
+
+def escapar_like(termo: str) -> str:
+    """Escapa os curingas do LIKE para que ``termo`` seja comparado literalmente."""
+    return termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def somente_digitos(texto: str) -> str:
+    """"123.456.789-00" -> "12345678900"."""
+    return "".join(c for c in (texto or "") if c.isdigit())
@@ -0,0 +1,176 @@
+"""
+Plano de execução das filas de pedidos (migrações 2, 3 e 8).
+
+Cada consulta de fila é capturada ao ser executada pelo repositório e
+passada por ``EXPLAIN FORMAT=JSON``: o teste falha se ``pedidos`` for lido
+por varredura completa (access_type ALL) ou ordenado por filesort.
+"""
+import json
+
+import pytest
+
+ALIASES_PEDIDOS = {"p", "pedidos"}
+# Chaves que envolvem as tabelas de um mesmo bloco; subconsultas e ramos de
+# UNION (query_specifications, materialized_from_subquery) são outros blocos.
+_ENVOLTORIOS = ("ordering_operation", "grouping_operation", "duplicates_removal", "windowing", "buffer_result")
+
+
+def _tabelas_do_bloco(no) -> list[dict]:
+    if not isinstance(no, dict):
+        return []
+    if "table_name" in no:
+        return [no]
+    tabelas = []
+    if "table" in no:
+        tabelas += _tabelas_do_bloco(no["table"])
+    for item in no.get("nested_loop", []):
+        tabelas += _tabelas_do_bloco(item)
+    for chave in _ENVOLTORIOS:
+        tabelas += _tabelas_do_bloco(no.get(chave))
+    return tabelas
+
+
+def _percorrer(no):
+    if isinstance(no, dict):
+        yield no
+        for valor in no.values():
+            yield from _percorrer(valor)
+    elif isinstance(no, list):
+        for item in no:
+            yield from _percorrer(item)
+
+
+def problemas_no_plano(plano: dict) -> list[str]:
+    """Varreduras completas e filesorts sobre ``pedidos`` em um EXPLAIN JSON."""
+    problemas = []
+    for no in _percorrer(plano):
+        if no.get("table_name") in ALIASES_PEDIDOS and no.get("access_type") == "ALL":
+            problemas.append(f"varredura completa em {no['table_name']}")
+        ordenacao = no.get("ordering_operation")
+        if isinstance(ordenacao, dict) and ordenacao.get("using_filesort"):
+            nomes = {t.get("table_name") for t in _tabelas_do_bloco(ordenacao)}
+            if nomes & ALIASES_PEDIDOS:
+                problemas.append(f"filesort sobre {sorted(nomes)}")
+    return problemas
+
+
+@pytest.fixture
+def capturar(app, monkeypatch):
+    """Guarda os SELECTs executados pelo repositório (sem alterar a execução)."""
+    from app.database import _CursorRastreado
+
+    capturadas = []
+    original = _CursorRastreado.execute
+
+    def execute(self, operacao, params=None, *args, **kwargs):
+        if operacao.lstrip().upper().startswith(("SELECT", "(SELECT")):
+            capturadas.append((operacao, params))
+        return original(self, operacao, params, *args, **kwargs)
+
+    monkeypatch.setattr(_CursorRastreado, "execute", execute)
+    return capturadas
+
+
+def _explicar(consultas) -> list[str]:
+    from app.extensions import mysql
+
+    problemas = []
+    with mysql.get_cursor(dictionary=False) as (_, cursor):
+        for sql, params in consultas:
+            cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+            (plano,) = cursor.fetchone()
+            problemas += [f"{p}: {sql.split()[:4]}" for p in problemas_no_plano(json.loads(plano))]
+    return problemas
+
+
+def _cenarios(massa):
+    from app.repositories import pedidos as pedidos_repo
+
+    unidade = massa["unidade_id"]
+    pagina_malote = pedidos_repo.listar_para_malote(limite=5)
+    pagina_medico = pedidos_repo.listar_para_medico("municipal", limite=5)
+    pagina_unidade = pedidos_repo.listar_por_unidade(unidade, limite=5)
+    return {
+        "malote": lambda: pedidos_repo.listar_para_malote(),
+        "malote_unidade": lambda: pedidos_repo.listar_para_malote(unidade_id=unidade, categoria="exame"),
+        "malote_cursor": lambda: pedidos_repo.listar_para_malote(cursor=pagina_malote.proximo_cursor),
+        "medico": lambda: pedidos_repo.listar_para_medico("municipal", usuario_id=massa["admin_id"]),
+        "medico_unidade": lambda: pedidos_repo.listar_para_medico("estadual", unidade_id=unidade),
+        "medico_cursor": lambda: pedidos_repo.listar_para_medico("municipal", cursor=pagina_medico.proximo_cursor),
+        "unidade": lambda: pedidos_repo.listar_por_unidade(unidade),
+        "unidade_cursor": lambda: pedidos_repo.listar_por_unidade(unidade, cursor=pagina_unidade.proximo_cursor),
+        "status": lambda: pedidos_repo.listar_por_status("aguardando_triagem"),
+    }
+
+
+@pytest.mark.parametrize(
+    "cenario",
+    [
+        "malote",
+        "malote_unidade",
+        "malote_cursor",
+        "medico",
+        "medico_unidade",
+        "medico_cursor",
+        "unidade",
+        "unidade_cursor",
+        "status",
+    ],
+)
+def test_filas_sem_varredura_nem_filesort(massa, capturar, cenario):
+    _cenarios(massa)[cenario]()
+    assert capturar, "nenhuma consulta capturada"
+    assert _explicar(capturar) == []
+
+
+def test_agendador_sem_varredura(massa, capturar):
+    """
+    A lista do agendador ordena por prioridade ASC e data DESC sobre dois
+    status, o que nenhum índice entrega pronto; o sort fica restrito às
+    linhas da lista de trabalho (no máximo AGENDAMENTO_LISTA_MAXIMA). Aqui só
+    se exige que ``pedidos`` seja lido por índice.
+    """
+    from app.repositories import pedidos as pedidos_repo
+
+    pedidos_repo.listar_para_agendador("municipal", reservado_por=massa["admin_id"])
+    pedidos_repo.listar_para_agendador("estadual", prioridade="P1")
+    assert [p for p in _explicar(capturar) if p.startswith("varredura")] == []
+
+
+def test_detecta_filesort_e_varredura():
+    """O verificador reconhece os dois problemas no formato do EXPLAIN JSON."""
+    plano = {
+        "query_block": {
+            "ordering_operation": {
+                "using_filesort": True,
+                "nested_loop": [
+                    {"table": {"table_name": "p", "access_type": "ALL"}},
+                    {"table": {"table_name": "pa", "access_type": "eq_ref"}},
+                ],
+            }
+        }
+    }
+    assert sorted(problemas_no_plano(plano)) == ["filesort sobre ['p', 'pa']", "varredura completa em p"]
+
+    union = {
+        "query_block": {
+            "ordering_operation": {
+                "using_filesort": True,
+                "union_result": {
+                    "table_name": "<union1,2>",
+                    "access_type": "ALL",
+                    "query_specifications": [
+                        {
+                            "query_block": {
+                                "ordering_operation": {
+                                    "using_filesort": False,
+                                    "table": {"table_name": "p", "access_type": "range"},
+                                }
+                            }
+                        }
+                    ],
+                },
+            }
+        }
+    }
+    assert problemas_no_plano(union) == []
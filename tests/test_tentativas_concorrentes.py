@@ -0,0 +1,87 @@
+"""
+Tentativas de contato simultâneas no mesmo pedido (agendamento_service).
+
+Vários greenlets registram tentativas ao mesmo tempo, cada um com a sua
+conexão do pool: o ``SELECT ... FOR UPDATE`` precisa serializá-los, sem
+contador perdido nem tentativa/histórico duplicado.
+"""
+import pytest
+
+CONCORRENTES = 12
+
+
+def _em_paralelo(app, funcao, quantidade: int) -> list:
+    """Roda ``funcao`` em ``quantidade`` greenlets, cada um no seu contexto."""
+    gevent = pytest.importorskip("gevent")
+
+    def tarefa():
+        with app.app_context():
+            try:
+                return funcao()
+            except Exception as exc:  # noqa: BLE001 - o teste inspeciona o erro
+                return exc
+
+    greenlets = [gevent.spawn(tarefa) for _ in range(quantidade)]
+    gevent.joinall(greenlets, timeout=60, raise_error=True)
+    return [g.value for g in greenlets]
+
+
+def _estado(pedido_id: int) -> dict:
+    from app.extensions import mysql
+
+    with mysql.get_cursor(dictionary=True) as (_, cursor):
+        cursor.execute("SELECT status, tentativas_contato, versao FROM pedidos WHERE id = %s", (pedido_id,))
+        pedido = cursor.fetchone()
+        cursor.execute(
+            "SELECT tentativa_numero FROM tentativas_contato WHERE pedido_id = %s ORDER BY tentativa_numero",
+            (pedido_id,),
+        )
+        numeros = [linha["tentativa_numero"] for linha in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*) AS total FROM historico_pedidos WHERE pedido_id = %s", (pedido_id,))
+        historico = cursor.fetchone()["total"]
+    return {**pedido, "numeros": numeros, "historico": historico}
+
+
+def test_tentativas_simultaneas_sem_perda(app, massa, novo_pedido):
+    from app.domain.status import StatusPedido
+    from app.services.agendamento_service import registrar_tentativa
+
+    pedido_id = novo_pedido(StatusPedido.APROVADO_MUNICIPAL)
+
+    resultados = _em_paralelo(
+        app,
+        lambda: registrar_tentativa(pedido_id, massa["admin_id"], "recado", "teste", None, None, None),
+        CONCORRENTES,
+    )
+
+    assert [r for r in resultados if isinstance(r, Exception)] == []
+    estado = _estado(pedido_id)
+    assert estado["status"] == StatusPedido.AGENDAMENTO_EM_ANDAMENTO.value
+    assert estado["tentativas_contato"] == CONCORRENTES
+    assert estado["numeros"] == list(range(1, CONCORRENTES + 1))
+    assert estado["historico"] == CONCORRENTES
+    assert estado["versao"] == CONCORRENTES
+
+
+def test_tentativas_simultaneas_mesma_versao(app, massa, novo_pedido):
+    """Com a versão exibida na tela, só o primeiro grava; os demais recebem conflito."""
+    from app.domain.status import StatusPedido
+    from app.repositories.pedidos import ConflitoVersao
+    from app.services.agendamento_service import registrar_tentativa
+
+    pedido_id = novo_pedido(StatusPedido.APROVADO_MUNICIPAL)
+
+    resultados = _em_paralelo(
+        app,
+        lambda: registrar_tentativa(pedido_id, massa["admin_id"], "recado", "teste", None, None, None, versao=0),
+        CONCORRENTES,
+    )
+
+    erros = [r for r in resultados if isinstance(r, Exception)]
+    assert all(isinstance(e, ConflitoVersao) for e in erros), erros
+    assert len(erros) == CONCORRENTES - 1
+    estado = _estado(pedido_id)
+    assert estado["tentativas_contato"] == 1
+    assert estado["numeros"] == [1]
+    assert estado["historico"] == 1
+    assert estado["versao"] == 1